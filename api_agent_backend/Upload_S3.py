@@ -1,25 +1,302 @@
 
 import os
-import mysql.connector
+import json
+import hashlib
+import math
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from decouple import config
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from s3transfer.utils import ReadFileChunk
 
-host = config('host')
-user = config('user')
-password = config('password')
-database = config('database')
+from api_agent_backend.db_pool import get_connection
 
-DB_CONFIG = {
-    "host": host,
-    "user": user,
-    "password": password,
-    "database": database
-}
+# Point at a local S3 stand-in (MinIO, moto server) to test uploads end to end.
+AWS_S3_ENDPOINT_URL = config('AWS_S3_ENDPOINT_URL', default=None)
+
+# Streaming uploads buffer this much of ffmpeg's output per multipart part
+# (S3 requires at least 5 MB for every part but the last) and keep at most
+# S3_STREAM_MAX_INFLIGHT parts uploading while the encode continues.
+S3_STREAM_PART_SIZE = config('S3_STREAM_PART_SIZE_MB', default=16, cast=int) * 1024 * 1024
+S3_STREAM_MAX_INFLIGHT = config('S3_STREAM_MAX_INFLIGHT', default=4, cast=int)
+
+# Merged files of at least S3_MULTIPART_THRESHOLD go through resumable_upload
+# in S3_MULTIPART_CHUNKSIZE parts, S3_MAX_CONCURRENCY at a time (the boto3
+# defaults, 8 MB parts and 10 threads, underuse bandwidth on multi-GB
+# recordings); measure with `manage.py bench_s3_upload` before changing them.
+# Smaller files are sent with upload_file in a single PUT.
+S3_MULTIPART_THRESHOLD = config('S3_MULTIPART_THRESHOLD_MB', default=64, cast=int) * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = config('S3_MULTIPART_CHUNKSIZE_MB', default=64, cast=int) * 1024 * 1024
+S3_MAX_CONCURRENCY = config('S3_MAX_CONCURRENCY', default=16, cast=int)
+
+def transfer_config(chunksize=S3_MULTIPART_CHUNKSIZE, max_concurrency=S3_MAX_CONCURRENCY):
+    return TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=chunksize,
+        max_concurrency=max_concurrency,
+        use_threads=True,
+    )
+
+TRANSFER_CONFIG = transfer_config()
+
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+def get_s3_client(aws_access_key_id=None, aws_secret_access_key=None):
+    """
+    Process-wide S3 client per credential pair. Building a client loads
+    endpoint data and a credential chain, which is slow and not thread-safe;
+    a built client is thread-safe, so every upload in the process shares it.
+    """
+    key = (aws_access_key_id, aws_secret_access_key)
+    client = _s3_clients.get(key)
+    if client is not None:
+        return client
+
+    with _s3_clients_lock:
+        client = _s3_clients.get(key)
+        if client is None:
+            session = boto3.session.Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key
+            )
+            client = session.client(
+                's3',
+                endpoint_url=AWS_S3_ENDPOINT_URL,
+                config=Config(
+                    max_pool_connections=max(S3_MAX_CONCURRENCY, S3_STREAM_MAX_INFLIGHT) * 2,
+                    retries={"max_attempts": 5, "mode": "standard"},
+                ),
+            )
+            _s3_clients[key] = client
+    return client
+
+def _reset_s3_clients():
+    # Celery prefork children must not reuse the parent's connections.
+    global _s3_clients_lock
+    _s3_clients.clear()
+    _s3_clients_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_s3_clients)
+
+# S3 allows at most this many parts per multipart upload.
+S3_MAX_PARTS = 10000
+
+# Multipart uploads not completed within this many hours are aborted by
+# abort_stale_multipart_uploads.
+S3_ABANDONED_UPLOAD_HOURS = config('S3_ABANDONED_UPLOAD_HOURS', default=24, cast=int)
+
+# Presigned chunk URLs: uploads only need to outlive one chunk upload, GETs a whole merge.
+S3_PRESIGN_PUT_EXPIRES = config('S3_PRESIGN_PUT_EXPIRES', default=60 * 60, cast=int)
+
+# Largest chunk a presigned upload accepts; S3 rejects bigger bodies.
+S3_CHUNK_MAX_BYTES = config('S3_CHUNK_MAX_MB', default=200, cast=int) * 1024 * 1024
+S3_PRESIGN_GET_EXPIRES = config('S3_PRESIGN_GET_EXPIRES', default=6 * 60 * 60, cast=int)
+
+def chunk_prefix(session_id, folder_type):
+    return f"{session_id}/chunks/{folder_type}/"
+
+def presigned_chunk_upload_urls(bucket_name, session_id, folder_type, indexes,
+                                aws_access_key_id=None, aws_secret_access_key=None):
+    """
+    Presigned POSTs the browser uses to upload recording chunks straight to
+    S3, one per chunk index. The browser sends a multipart form with `fields`
+    followed by the file to `url`; S3 refuses bodies over S3_CHUNK_MAX_BYTES.
+    """
+    s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key)
+    urls = []
+    for index in indexes:
+        object_name = f"{chunk_prefix(session_id, folder_type)}chunk{index}.mp4"
+        post = s3_client.generate_presigned_post(
+            bucket_name, object_name,
+            Fields={"Content-Type": "video/mp4"},
+            Conditions=[
+                {"Content-Type": "video/mp4"},
+                ["content-length-range", 1, S3_CHUNK_MAX_BYTES],
+            ],
+            ExpiresIn=S3_PRESIGN_PUT_EXPIRES,
+        )
+        urls.append({"index": index, "key": object_name, "url": post["url"], "fields": post["fields"]})
+    return urls
+
+def list_chunk_objects(bucket_name, session_id, folder_type, aws_access_key_id=None, aws_secret_access_key=None):
+    s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key)
+    objects = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=chunk_prefix(session_id, folder_type)):
+        for obj in page.get("Contents", []):
+            name = obj["Key"].rsplit("/", 1)[-1]
+            if name.startswith("chunk") and name.endswith(".mp4"):
+                objects.append(obj)
+    return objects
+
+def checkpoint_path(file_name):
+    return f"{file_name}.upload.json"
+
+def save_checkpoint(file_name, checkpoint):
+    path = checkpoint_path(file_name)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+def load_checkpoint(s3_client, file_name, bucket_name, object_name, size, mtime):
+    """
+    Return the checkpoint of an earlier attempt to upload this exact file to
+    this key, with its parts refreshed from S3, or None to start over.
+    """
+    try:
+        with open(checkpoint_path(file_name)) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if (checkpoint.get("bucket"), checkpoint.get("key"), checkpoint.get("size"), checkpoint.get("mtime")) != \
+            (bucket_name, object_name, size, mtime):
+        return None
+
+    parts = {}
+    try:
+        paginator = s3_client.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=bucket_name, Key=object_name, UploadId=checkpoint["upload_id"]):
+            for part in page.get("Parts", []):
+                parts[str(part["PartNumber"])] = part["ETag"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+            print(f"Checkpointed upload {checkpoint['upload_id']} no longer exists, starting over.")
+            return None
+        raise
+
+    checkpoint["parts"] = parts
+    return checkpoint
+
+def file_sha256(file_name, block_size=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def existing_object_matches(s3_client, bucket_name, object_name, size, sha256):
+    """
+    True if object_name already holds these exact bytes, judged by the size
+    and the sha256 metadata recorded when it was uploaded. Any HEAD error
+    counts as no match: without s3:ListBucket S3 answers 403 for a missing
+    key, and the upload itself will report real permission problems.
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=object_name)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code not in ("404", "NoSuchKey", "NotFound"):
+            print(f"Could not check s3://{bucket_name}/{object_name} ({code}), uploading it.")
+        return False
+    return response.get("ContentLength") == size and response.get("Metadata", {}).get("sha256") == sha256
+
+def resumable_upload(s3_client, file_name, bucket_name, object_name, metadata=None, content_type="video/mp4",
+                     chunksize=S3_MULTIPART_CHUNKSIZE, max_concurrency=S3_MAX_CONCURRENCY):
+    """
+    Multipart upload that records its upload ID and the ETag of every
+    finished part in a checkpoint next to the file. If the worker dies, the
+    next attempt for the same file resumes after the last finished part
+    instead of re-sending the whole recording. A resumed upload keeps the
+    part size it was started with.
+    """
+    stat = os.stat(file_name)
+    size, mtime = stat.st_size, stat.st_mtime_ns
+
+    checkpoint = load_checkpoint(s3_client, file_name, bucket_name, object_name, size, mtime)
+    if checkpoint is None:
+        response = s3_client.create_multipart_upload(
+            Bucket=bucket_name, Key=object_name, ContentType=content_type, Metadata=metadata or {}
+        )
+        checkpoint = {
+            "bucket": bucket_name,
+            "key": object_name,
+            "size": size,
+            "mtime": mtime,
+            "part_size": max(chunksize, math.ceil(size / S3_MAX_PARTS)),
+            "upload_id": response["UploadId"],
+            "parts": {},
+        }
+        save_checkpoint(file_name, checkpoint)
+    else:
+        print(f"Resuming upload of {file_name}: {len(checkpoint['parts'])} parts already uploaded.")
+
+    part_size = checkpoint["part_size"]
+    part_count = max(1, math.ceil(size / part_size))
+    pending = [n for n in range(1, part_count + 1) if str(n) not in checkpoint["parts"]]
+    checkpoint_lock = threading.Lock()
+
+    def upload_part(part_number):
+        start = (part_number - 1) * part_size
+        with ReadFileChunk.from_filename(file_name, start, part_size) as body:
+            response = s3_client.upload_part(
+                Bucket=bucket_name, Key=object_name, UploadId=checkpoint["upload_id"],
+                PartNumber=part_number, Body=body
+            )
+        with checkpoint_lock:
+            checkpoint["parts"][str(part_number)] = response["ETag"]
+            save_checkpoint(file_name, checkpoint)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(pending))) as pool:
+            for future in [pool.submit(upload_part, n) for n in pending]:
+                future.result()
+
+    s3_client.complete_multipart_upload(
+        Bucket=bucket_name, Key=object_name, UploadId=checkpoint["upload_id"],
+        MultipartUpload={"Parts": [
+            {"PartNumber": int(n), "ETag": etag}
+            for n, etag in sorted(checkpoint["parts"].items(), key=lambda item: int(item[0]))
+        ]}
+    )
+    os.remove(checkpoint_path(file_name))
+
+def abort_stale_multipart_uploads(bucket_name, aws_access_key_id=None, aws_secret_access_key=None,
+                                  max_age_hours=S3_ABANDONED_UPLOAD_HOURS):
+    """
+    Abort multipart uploads that were started more than max_age_hours ago and
+    never completed, so their parts stop accruing storage. Returns the number aborted.
+    """
+    s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key)
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+    aborted = 0
+
+    paginator = s3_client.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=bucket_name):
+        for upload in page.get("Uploads", []):
+            if upload["Initiated"] >= cutoff:
+                continue
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=upload["Key"], UploadId=upload["UploadId"])
+            print(f"Aborted abandoned upload {upload['UploadId']} of {upload['Key']} started {upload['Initiated']}")
+            aborted += 1
+
+    return aborted
 
 def get_db_connection():
-    return mysql.connector.connect(**DB_CONFIG)
+    return get_connection()
+
+def object_url(bucket_name, object_name):
+    if AWS_S3_ENDPOINT_URL:
+        return f"{AWS_S3_ENDPOINT_URL.rstrip('/')}/{bucket_name}/{object_name}"
+    return f"https://{bucket_name}.s3.amazonaws.com/{object_name}"
+
+OUTPUT_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".ts": "video/mp2t",
+    ".jpg": "image/jpeg",
+    ".json": "application/json",
+    ".ogg": "audio/ogg",
+    ".flac": "audio/flac",
+}
 
 def upload_video_to_s3(file_name, bucket_name, session_id, folder_type, aws_access_key_id=None, aws_secret_access_key=None):
     if folder_type not in ['screen_uploads', 'Camera_uploads']:
@@ -28,15 +305,29 @@ def upload_video_to_s3(file_name, bucket_name, session_id, folder_type, aws_acce
 
     object_name = f"{session_id}/{folder_type}/{os.path.basename(file_name)}"
 
-    s3_client = boto3.client('s3', 
-                            aws_access_key_id=aws_access_key_id,
-                            aws_secret_access_key=aws_secret_access_key)
+    s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key)
 
     try:
-        s3_client.upload_file(file_name, bucket_name, object_name)
+        size = os.path.getsize(file_name)
+        # Reading the file back is far cheaper than sending it again: a retried
+        # or duplicate merge that produced the same bytes skips the upload.
+        sha256 = file_sha256(file_name)
+        metadata = {"sha256": sha256}
+        content_type = OUTPUT_CONTENT_TYPES.get(os.path.splitext(file_name)[1], "video/mp4")
 
-        print(f"File {file_name} uploaded successfully to {bucket_name}/{object_name}")
-        file_url = f"https://{bucket_name}.s3.amazonaws.com/{object_name}"
+        if existing_object_matches(s3_client, bucket_name, object_name, size, sha256):
+            print(f"{bucket_name}/{object_name} already holds {file_name} (sha256 {sha256}), skipping upload.")
+        elif size >= S3_MULTIPART_THRESHOLD:
+            resumable_upload(s3_client, file_name, bucket_name, object_name, metadata, content_type)
+            print(f"File {file_name} uploaded successfully to {bucket_name}/{object_name}")
+        else:
+            s3_client.upload_file(
+                file_name, bucket_name, object_name,
+                ExtraArgs={"Metadata": metadata, "ContentType": content_type}, Config=TRANSFER_CONFIG
+            )
+            print(f"File {file_name} uploaded successfully to {bucket_name}/{object_name}")
+
+        file_url = object_url(bucket_name, object_name)
         print(f"File URL: {file_url}")
 
         os.remove(file_name)
@@ -56,7 +347,129 @@ def upload_video_to_s3(file_name, bucket_name, session_id, folder_type, aws_acce
         print(f"Error uploading file: {e}")
         return None
 
-def store_video_urls_in_db(session_id, screen_url=None, camera_url=None):
+def upload_directory_to_s3(directory, bucket_name, session_id, folder_type, subfolder, index_suffix,
+                           aws_access_key_id=None, aws_secret_access_key=None):
+    """
+    Upload the files merge_chunks wrote next to a merged video (an HLS
+    rendition, preview sprites) under <session>/<folder_type>/<subfolder>/
+    and return the URL of the index file, the one ending in index_suffix.
+    Everything else goes up first and the index last, so a reader never sees
+    an index that references a file not uploaded yet.
+    """
+    if folder_type not in ['screen_uploads', 'Camera_uploads']:
+        print(f"Invalid folder_type: {folder_type}")
+        return None
+
+    files = sorted(path for path in Path(directory).iterdir() if path.is_file())
+    indexes = [path for path in files if path.name.endswith(index_suffix)]
+    others = [path for path in files if not path.name.endswith(index_suffix)]
+    if not indexes:
+        print(f"No *{index_suffix} in {directory}")
+        return None
+
+    prefix = f"{session_id}/{folder_type}/{subfolder}"
+    s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key)
+
+    def upload(path):
+        s3_client.upload_file(
+            str(path), bucket_name, f"{prefix}/{path.name}",
+            ExtraArgs={"ContentType": OUTPUT_CONTENT_TYPES.get(path.suffix, "application/octet-stream")},
+            Config=TRANSFER_CONFIG
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY) as pool:
+            list(pool.map(upload, others))
+        for index in indexes:
+            upload(index)
+    except Exception as e:
+        print(f"Error uploading {directory}: {e}")
+        return None
+
+    for path in files:
+        path.unlink()
+    index_url = object_url(bucket_name, f"{prefix}/{indexes[0].name}")
+    print(f"Uploaded {len(files)} files to {bucket_name}/{prefix}: {index_url}")
+    return index_url
+
+class S3StreamUpload:
+    """
+    Sink for merg_chunks.merge_chunks that uploads ffmpeg's output as S3
+    multipart parts while the encode is still running, so no full-size local
+    copy of the merged video is written.
+    """
+
+    def __init__(self, bucket_name, session_id, folder_type, file_name, aws_access_key_id=None, aws_secret_access_key=None):
+        if folder_type not in ['screen_uploads', 'Camera_uploads']:
+            raise ValueError(f"Invalid folder_type: {folder_type}")
+
+        self.bucket_name = bucket_name
+        self.object_name = f"{session_id}/{folder_type}/{file_name}"
+        self.s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key)
+        self.upload_id = None
+        self.parts = []
+        self.url = None
+
+    def __str__(self):
+        return f"s3://{self.bucket_name}/{self.object_name}"
+
+    def consume(self, stream):
+        response = self.s3_client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=self.object_name, ContentType="video/mp4"
+        )
+        self.upload_id = response["UploadId"]
+        self.parts = []
+
+        inflight = threading.BoundedSemaphore(S3_STREAM_MAX_INFLIGHT)
+        futures = []
+
+        def upload_part(part_number, data):
+            try:
+                response = self.s3_client.upload_part(
+                    Bucket=self.bucket_name, Key=self.object_name, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=data
+                )
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            finally:
+                inflight.release()
+
+        with ThreadPoolExecutor(max_workers=S3_STREAM_MAX_INFLIGHT) as pool:
+            part_number = 1
+            while True:
+                data = stream.read(S3_STREAM_PART_SIZE)
+                if not data:
+                    break
+                inflight.acquire()
+                futures.append(pool.submit(upload_part, part_number, data))
+                part_number += 1
+                failed = [future for future in futures if future.done() and future.exception()]
+                if failed:
+                    raise failed[0].exception()
+
+        self.parts = [future.result() for future in futures]
+        print(f"Streamed {len(self.parts)} parts to {self}")
+
+    def complete(self):
+        if not self.parts:
+            raise RuntimeError("ffmpeg produced no output")
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self.object_name, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+        self.upload_id = None
+        self.url = object_url(self.bucket_name, self.object_name)
+        print(f"File URL: {self.url}")
+
+    def abort(self):
+        if self.upload_id:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.object_name, UploadId=self.upload_id
+            )
+            print(f"Aborted multipart upload to {self}")
+        self.upload_id = None
+        self.parts = []
+
+def store_video_urls_in_db(session_id, screen_url=None, camera_url=None, audio_url=None):
     conn = get_db_connection()
     if not conn:
         print("Database connection failed. Cannot insert data.")
@@ -68,10 +481,11 @@ def store_video_urls_in_db(session_id, screen_url=None, camera_url=None):
         update_query = """
             UPDATE interview_evaluations
             SET screen_uploads = %s,
-                Camera_uploads = %s
+                Camera_uploads = %s,
+                audio_uploads = %s
             WHERE session_id = %s
         """
-        cursor.execute(update_query, (screen_url, camera_url, session_id))
+        cursor.execute(update_query, (screen_url, camera_url, audio_url, session_id))
         print(f"Updated existing record for session_id: {session_id}")
     
 
@@ -0,0 +1,149 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from decouple import config
+from filelock import Timeout
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from api_agent_backend.chunk_manifest import (
+    manifest_lock, load_manifest, save_manifest, current_entry,
+)
+from api_agent_backend.encoder_profiles import get_profile
+from api_agent_backend.merg_chunks import (
+    MERGE_MODE, ffmpeg_slots, chunk_number, probe_entry, normalize_chunk, normalized_path, streams_match,
+)
+
+
+BASE_DIR = Path(config('BASE_DIR'))
+INGEST_ROOTS = [BASE_DIR / "uploads", BASE_DIR / "screen_uploads"]
+INGEST_WORKERS = config('INGEST_WORKERS', default=2, cast=int)
+
+# A merge holds the session's manifest lock for its whole run. Ingest waits
+# at most INGEST_LOCK_TIMEOUT seconds for it, then gives the worker back and
+# tries the chunk again INGEST_RETRY_SECONDS later.
+INGEST_LOCK_TIMEOUT = config('INGEST_LOCK_TIMEOUT', default=5, cast=float)
+INGEST_RETRY_SECONDS = config('INGEST_RETRY_SECONDS', default=30, cast=float)
+
+
+def is_chunk(path: Path) -> bool:
+    return path.name.startswith("chunk") and path.suffix == ".mp4"
+
+
+def ingest_chunk(chunk_path: Path):
+    """
+    Probe a freshly uploaded chunk and record it in the session manifest.
+
+    While every chunk of the session matches the first one, chunks are only
+    validated so the final merge can stream-copy them. As soon as one does
+    not match (or MERGE_MODE is "transcode"), this chunk and any earlier ones
+    are normalized here, with the ENCODER_PROFILE raster, so the merge only
+    has to run the final concat.
+
+    Raises filelock.Timeout if the session is being merged.
+    """
+    folder = chunk_path.parent
+
+    with manifest_lock(folder).acquire(timeout=INGEST_LOCK_TIMEOUT):
+        if not chunk_path.exists():
+            return
+
+        manifest = load_manifest(folder)
+        if current_entry(manifest, chunk_path):
+            return
+
+        entry = probe_entry(chunk_path)
+
+        if manifest.get("reference") is None and entry["probe"]:
+            manifest["reference"] = entry["probe"]
+
+        # A chunk ffprobe cannot read yet (e.g. still being written when the
+        # startup scan found it) says nothing about compatibility; the merge
+        # probes it again.
+        if entry["probe"] is not None:
+            compatible = (
+                MERGE_MODE == "auto"
+                and entry["probe"]["video_codec"] is not None
+                and streams_match(entry["probe"], manifest["reference"])
+            )
+            manifest["copy_compatible"] = manifest.get("copy_compatible", True) and compatible
+        else:
+            manifest.setdefault("copy_compatible", MERGE_MODE == "auto")
+        manifest["chunks"][chunk_path.name] = entry
+        save_manifest(folder, manifest)
+        print(f"Ingested {chunk_path} (copy_compatible={manifest['copy_compatible']})")
+
+        # single_pass merges decode the original chunks, so only the probe is useful.
+        if manifest["copy_compatible"] or MERGE_MODE == "single_pass":
+            return
+
+        profile = get_profile()
+        for name in sorted(manifest["chunks"], key=lambda name: chunk_number(folder / name)):
+            chunk = folder / name
+            chunk_entry = current_entry(manifest, chunk)
+            if not chunk_entry or chunk_entry.get("probe") is None or chunk_entry.get("profile") == profile["name"]:
+                continue
+            with ffmpeg_slots:
+                normalize_chunk(chunk, normalized_path(chunk), profile=profile)
+            chunk_entry["normalized"] = normalized_path(chunk).name
+            chunk_entry["profile"] = profile["name"]
+            save_manifest(folder, manifest)
+            print(f"Normalized {chunk} at ingest time")
+
+
+class ChunkEventHandler(FileSystemEventHandler):
+    """
+    Queues a chunk for ingest once its writer closes it or renames it into place.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def on_closed(self, event):
+        self.submit(Path(event.src_path))
+
+    def on_moved(self, event):
+        self.submit(Path(event.dest_path))
+
+    def submit(self, path: Path):
+        # Retried chunks may be gone by now: merged and evicted with their folder.
+        if is_chunk(path) and path.exists():
+            self.pool.submit(self.ingest, path)
+
+    def ingest(self, chunk_path: Path):
+        try:
+            ingest_chunk(chunk_path)
+        except Timeout:
+            print(f"{chunk_path.parent} is locked by a merge, retrying {chunk_path.name} in {INGEST_RETRY_SECONDS}s")
+            retry = threading.Timer(INGEST_RETRY_SECONDS, self.submit, args=(chunk_path,))
+            retry.daemon = True
+            retry.start()
+        except Exception as e:
+            print(f"Ingest failed for {chunk_path}: {e}")
+
+
+def watch_chunks():
+    pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS)
+    observer = Observer()
+    handler = ChunkEventHandler(pool)
+
+    for root in INGEST_ROOTS:
+        root.mkdir(parents=True, exist_ok=True)
+        observer.schedule(handler, str(root), recursive=True)
+    observer.start()
+
+    # Chunks that landed while the watcher was down.
+    for root in INGEST_ROOTS:
+        for chunk in root.glob("*/chunk*.mp4"):
+            handler.submit(chunk)
+
+    print(f"Watching {', '.join(str(root) for root in INGEST_ROOTS)} for new chunks...")
+    try:
+        while observer.is_alive():
+            time.sleep(1)
+    finally:
+        observer.stop()
+        observer.join()
+        pool.shutdown(wait=True)
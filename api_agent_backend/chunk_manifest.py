@@ -0,0 +1,58 @@
+import json
+import os
+from pathlib import Path
+
+from filelock import FileLock
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_LOCK_NAME = ".manifest.lock"
+
+
+def manifest_lock(folder: Path) -> FileLock:
+    """
+    Cross-process lock for a session folder. The chunk watcher and the merge
+    workers run in different processes, so a threading lock is not enough.
+    """
+    return FileLock(str(folder / MANIFEST_LOCK_NAME))
+
+
+def load_manifest(folder: Path) -> dict:
+    try:
+        return json.loads((folder / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {"chunks": {}}
+
+
+def save_manifest(folder: Path, manifest: dict):
+    path = folder / MANIFEST_NAME
+    tmp_path = folder / f"{MANIFEST_NAME}.tmp"
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, path)
+
+
+def delete_manifest(folder: Path):
+    path = folder / MANIFEST_NAME
+    if path.exists():
+        path.unlink()
+
+
+def file_signature(path: Path) -> dict:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def current_entry(manifest: dict, chunk: Path):
+    """
+    Return the manifest entry for a chunk, or None if the chunk changed since it was recorded.
+    """
+    entry = manifest.get("chunks", {}).get(chunk.name)
+    if not entry:
+        return None
+    try:
+        signature = file_signature(chunk)
+    except FileNotFoundError:
+        return None
+    if entry.get("size") != signature["size"] or entry.get("mtime") != signature["mtime"]:
+        return None
+    return entry
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+from decouple import config
+from django.conf import settings
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+
+
+# Sized in settings (see DB_POOL_SIZE there). A caller that finds every
+# connection checked out waits up to DB_POOL_TIMEOUT seconds for one.
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=30, cast=float)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection_config() -> dict:
+    """
+    mysql.connector arguments for the default Django database, so raw SQL
+    and the ORM always talk to the same server.
+    """
+    database = settings.DATABASES['default']
+    return {
+        "host": database['HOST'],
+        "port": int(database['PORT'] or 3306),
+        "user": database['USER'],
+        "password": database['PASSWORD'],
+        "database": database['NAME'],
+    }
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=f"api_agent_{os.getpid()}",
+                    pool_size=settings.DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    **connection_config()
+                )
+    return _pool
+
+
+def _reset_pool():
+    # Celery prefork children must not share the parent's sockets.
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pool)
+
+
+def get_connection():
+    """
+    Check a connection out of the process-wide pool. It is used exactly like
+    one from mysql.connector.connect(); close() returns it to the pool
+    instead of tearing down the TCP connection and MySQL session.
+
+    The pool pings every connection it hands out and reconnects it if MySQL
+    dropped it (wait_timeout, failover), so callers never get a dead one.
+    """
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            return get_pool().get_connection()
+        except PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
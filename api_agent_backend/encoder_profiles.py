@@ -0,0 +1,41 @@
+from decouple import config
+
+
+# Named ffmpeg settings for merges that re-encode. width/height/fps are the
+# output raster, crf/preset the libx264 quality and speed trade-off, threads
+# the encoder threads of the final encode (0 lets x264 decide) and
+# audio_bitrate the AAC bitrate. Compare them with `manage.py bench_merge`.
+# "standard" is the default and keeps the quality merges had before profiles
+# existed (x264's CRF 23 / medium and ffmpeg's 128k AAC at 1600x900); "fast"
+# and "balanced" trade quality for speed and are opt-in.
+ENCODER_PROFILES = {
+    "fast": {
+        "width": 1280, "height": 720, "fps": 15,
+        "crf": 30, "preset": "ultrafast", "threads": 0, "audio_bitrate": "64k",
+    },
+    "balanced": {
+        "width": 1600, "height": 900, "fps": 15,
+        "crf": 27, "preset": "veryfast", "threads": 0, "audio_bitrate": "96k",
+    },
+    "standard": {
+        "width": 1600, "height": 900, "fps": 15,
+        "crf": 23, "preset": "medium", "threads": 0, "audio_bitrate": "128k",
+    },
+    "quality": {
+        "width": 1920, "height": 1080, "fps": 30,
+        "crf": 23, "preset": "medium", "threads": 0, "audio_bitrate": "128k",
+    },
+}
+
+ENCODER_PROFILE = config('ENCODER_PROFILE', default='standard')
+
+
+def get_profile(name: str = None) -> dict:
+    """
+    Settings of the named profile, or of ENCODER_PROFILE when name is None.
+    Raises ValueError for an unknown name.
+    """
+    name = name or ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {name}, expected one of {', '.join(ENCODER_PROFILES)}")
+    return {"name": name, **ENCODER_PROFILES[name]}
@@ -0,0 +1,131 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from api_agent_backend.redis_client import get_redis
+
+
+# Limits of the report API: at most EVALUATION_RATE_PER_SECOND requests on
+# average (0 disables the limit) and bursts of up to EVALUATION_BURST, shared
+# by every dispatcher worker through Redis; and at most
+# EVALUATION_MAX_IN_FLIGHT requests per worker waiting for a response.
+EVALUATION_RATE_PER_SECOND = config('EVALUATION_RATE_PER_SECOND', default=1.0, cast=float)
+EVALUATION_BURST = config('EVALUATION_BURST', default=5, cast=int)
+# Set in settings, which sizes the DB pool from it.
+EVALUATION_MAX_IN_FLIGHT = settings.EVALUATION_MAX_IN_FLIGHT
+
+EVALUATION_RATE_KEY = "evaluations:rate"
+
+# Takes a token from the bucket stored at KEYS[1] if one is available and
+# returns how many seconds the caller has to wait otherwise. Redis' clock is
+# used so that workers on different hosts agree on the refill.
+TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available.
+    Tokens refill at `rate` per second up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in Redis under `key`, so every process taking from it
+    shares one rate. Falls back to a bucket local to this process while
+    Redis is unavailable.
+    """
+
+    def __init__(self, key, rate, capacity):
+        self.key = key
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.local = TokenBucket(rate, capacity)
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            try:
+                wait = float(get_redis().eval(TAKE_TOKEN_SCRIPT, 1, self.key, self.rate, self.capacity))
+            except RedisError as e:
+                print(f"Redis unavailable for the evaluation rate limit, limiting this worker only: {e}")
+                self.local.acquire()
+                return
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+def dispatch(items, send, rate=EVALUATION_RATE_PER_SECOND, burst=EVALUATION_BURST,
+             max_in_flight=EVALUATION_MAX_IN_FLIGHT):
+    """
+    Call send(item) for every item on a pool of max_in_flight threads,
+    starting at most `rate` calls per second across all workers. items is
+    consumed lazily, so a loader generator is only read as fast as requests
+    go out. A failing send is logged and does not stop the others. Returns
+    the number sent.
+    """
+    bucket = SharedTokenBucket(EVALUATION_RATE_KEY, rate, burst)
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    sent = 0
+
+    def run(item):
+        try:
+            send(item)
+        except Exception as e:
+            print(f"Dispatch failed for {item.get('session_id', item) if isinstance(item, dict) else item}: {e}")
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for item in items:
+            in_flight.acquire()
+            bucket.acquire()
+            pool.submit(run, item)
+            sent += 1
+
+    return sent
@@ -0,0 +1,124 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+
+# Timeouts of every outbound call, in seconds: connecting, then waiting for
+# the response once the request is sent.
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=5, cast=float)
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=60, cast=float)
+
+# Retries after a connection error or a RETRY_STATUSES response, waiting a
+# random time up to HTTP_BACKOFF_BASE * 2**attempt (capped at
+# HTTP_BACKOFF_MAX) between attempts. Read timeouts are not retried: the
+# server may already have acted on the request.
+HTTP_MAX_RETRIES = config('HTTP_MAX_RETRIES', default=3, cast=int)
+HTTP_BACKOFF_BASE = config('HTTP_BACKOFF_BASE', default=0.5, cast=float)
+HTTP_BACKOFF_MAX = config('HTTP_BACKOFF_MAX', default=10, cast=float)
+
+# Keep-alive connections per host; at least EVALUATION_MAX_IN_FLIGHT.
+HTTP_POOL_SIZE = config('HTTP_POOL_SIZE', default=10, cast=int)
+
+RETRY_STATUSES = {500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "retries": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0}
+
+
+def get_session() -> requests.Session:
+    """
+    Process-wide requests session, so calls to the same host reuse one
+    TCP/TLS connection instead of handshaking every time.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _reset_session():
+    # Celery prefork children must not share the parent's sockets.
+    global _session, _session_lock, _stats_lock
+    _session = None
+    _session_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _stats.update(requests=0, retries=0, errors=0, latency_total=0.0, latency_max=0.0)
+
+
+os.register_at_fork(after_in_child=_reset_session)
+
+
+def record(latency=None, retry=False, error=False):
+    with _stats_lock:
+        if latency is not None:
+            _stats["requests"] += 1
+            _stats["latency_total"] += latency
+            _stats["latency_max"] = max(_stats["latency_max"], latency)
+        if retry:
+            _stats["retries"] += 1
+        if error:
+            _stats["errors"] += 1
+
+
+def http_stats() -> dict:
+    """
+    Counters of this process: responses received, retries, calls that failed
+    without a response, and response latency in seconds.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["latency_avg"] = stats["latency_total"] / stats["requests"] if stats["requests"] else 0.0
+    return stats
+
+
+def backoff(attempt: int) -> float:
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    requests.request() over the shared session, with default timeouts and
+    retries. Returns the last response, which may still be a 5xx, or raises
+    the last RequestException.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if attempt >= HTTP_MAX_RETRIES:
+                record(error=True)
+                raise
+            print(f"{method} {url} failed ({e}), retrying.")
+        except requests.exceptions.RequestException:
+            record(error=True)
+            raise
+        else:
+            record(latency=time.monotonic() - started)
+            if response.status_code not in RETRY_STATUSES or attempt >= HTTP_MAX_RETRIES:
+                return response
+            print(f"{method} {url} returned {response.status_code}, retrying.")
+            response.close()
+
+        record(retry=True)
+        time.sleep(backoff(attempt))
+        attempt += 1
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
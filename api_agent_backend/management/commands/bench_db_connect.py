@@ -0,0 +1,48 @@
+import statistics
+import time
+
+import mysql.connector
+from django.core.management.base import BaseCommand
+
+from api_agent_backend.db_pool import connection_config, get_connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the cost of opening a new MySQL connection per query with "
+        "checking one out of the shared pool (db_pool.get_connection)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        db_config = connection_config()
+        self.stdout.write(f"Database: {db_config['user']}@{db_config['host']}:{db_config['port']}/{db_config['database']}")
+
+        self.report("connect per call", self.measure(lambda: mysql.connector.connect(**db_config), iterations))
+        # Fill the pool before timing so only checkouts are measured.
+        get_connection().close()
+        self.report("pooled", self.measure(get_connection, iterations))
+
+    def measure(self, connect, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            conn = connect()
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            conn.close()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def report(self, label, timings):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"{label:>16}: mean {statistics.mean(timings):7.2f} ms, "
+            f"p50 {statistics.median(timings):7.2f} ms, p95 {p95:7.2f} ms"
+        )
@@ -0,0 +1,124 @@
+import multiprocessing
+import queue
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api_agent_backend.encoder_profiles import ENCODER_PROFILES
+from api_agent_backend.merg_chunks import merge_chunks
+
+
+MB = 1024 * 1024
+
+# Browsers change resolution mid-recording (window resizes, tab sharing), so
+# synthetic chunks cycle through these to make the merge re-encode.
+CHUNK_SIZES = ["1280x720", "1920x1080", "1366x768"]
+
+
+def generate_chunks(folder: Path, count: int, seconds: int):
+    for i in range(count):
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={CHUNK_SIZES[i % len(CHUNK_SIZES)]}:rate=30",
+            "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+            "-t", str(seconds),
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+            "-c:a", "aac",
+            str(folder / f"chunk{i}.mp4")
+        ]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise CommandError(f"Could not generate test chunks: {result.stderr.decode()}")
+
+
+def run_case(source: Path, work: Path, mode: str, profile: str, results):
+    """
+    Merge a fresh copy of the source chunks. Runs in its own process so that
+    RUSAGE_CHILDREN covers exactly the ffmpeg processes of this case.
+    """
+    output = work / "final.mp4"
+    started = time.perf_counter()
+    try:
+        shutil.copytree(source, work)
+        started = time.perf_counter()
+        success, message = merge_chunks(work, output, mode=mode, profile=profile)
+        success = success and output.exists()
+    except Exception as e:
+        success, message = False, str(e)
+    wall = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results.put({
+        "success": success,
+        "message": message,
+        "wall": wall,
+        "cpu": usage.ru_utime + usage.ru_stime,
+        "max_rss_mb": usage.ru_maxrss / 1024,
+        "size_mb": output.stat().st_size / MB if success else None,
+    })
+
+
+def wait_for_result(process, results):
+    """
+    The case's result, or a failure if its process died without sending one.
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            return {"success": False, "message": f"benchmark process exited with code {process.exitcode}"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge synthetic chunks generated with ffmpeg's test sources under "
+        "each encoder profile and report wall time, CPU seconds, peak RSS and "
+        "output size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", nargs="+", default=list(ENCODER_PROFILES), choices=list(ENCODER_PROFILES))
+        parser.add_argument("--modes", nargs="+", default=["transcode", "single_pass"],
+                            choices=["auto", "transcode", "single_pass"])
+        parser.add_argument("--chunks", type=int, default=6)
+        parser.add_argument("--chunk-seconds", type=int, default=10)
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context("fork")
+
+        with tempfile.TemporaryDirectory(prefix="bench_merge_") as tmp:
+            source = Path(tmp) / "source"
+            source.mkdir()
+            generate_chunks(source, options["chunks"], options["chunk_seconds"])
+            media_seconds = options["chunks"] * options["chunk_seconds"]
+            self.stdout.write(f"{options['chunks']} chunks, {media_seconds}s of media")
+
+            for mode in options["modes"]:
+                for profile in options["profiles"]:
+                    results = context.Queue()
+                    process = context.Process(
+                        target=run_case,
+                        args=(source, Path(tmp) / f"{mode}_{profile}", mode, profile, results)
+                    )
+                    process.start()
+                    result = wait_for_result(process, results)
+                    process.join()
+
+                    label = f"{mode:>11} {profile:>9}"
+                    if not result["success"]:
+                        self.stdout.write(f"{label}: failed: {result['message']}")
+                        continue
+                    self.stdout.write(
+                        f"{label}: wall {result['wall']:7.2f}s ({media_seconds / result['wall']:5.1f}x realtime), "
+                        f"cpu {result['cpu']:7.2f}s, peak rss {result['max_rss_mb']:7.1f} MB, "
+                        f"output {result['size_mb']:7.2f} MB"
+                    )
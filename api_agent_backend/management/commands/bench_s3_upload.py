@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+import uuid
+
+import boto3
+from decouple import config
+from django.core.management.base import BaseCommand
+
+from api_agent_backend.Upload_S3 import (
+    AWS_S3_ENDPOINT_URL, S3_MAX_CONCURRENCY, S3_MULTIPART_CHUNKSIZE, get_s3_client, resumable_upload,
+)
+
+
+MB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the throughput of resumable_upload, the path merged videos "
+        "take, for different part sizes and concurrency. Set AWS_S3_ENDPOINT_URL "
+        "to run it against MinIO or moto server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bucket", default=config('BUCKET_NAME'))
+        parser.add_argument("--size-mb", type=int, default=512)
+        parser.add_argument("--chunksize-mb", type=int, nargs="+", default=[S3_MULTIPART_CHUNKSIZE // MB])
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[S3_MAX_CONCURRENCY])
+        parser.add_argument("--runs", type=int, default=3)
+
+    def handle(self, *args, **options):
+        access_key = config('AWS_ACCESS_KEY_ID', default=None)
+        secret_key = config('AWS_SECRET_ACCESS_KEY', default=None)
+        self.stdout.write(f"Endpoint: {AWS_S3_ENDPOINT_URL or 'AWS'}, bucket: {options['bucket']}")
+
+        started = time.perf_counter()
+        boto3.client('s3', endpoint_url=AWS_S3_ENDPOINT_URL,
+                     aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        new_client_ms = (time.perf_counter() - started) * 1000
+        s3_client = get_s3_client(access_key, secret_key)
+        started = time.perf_counter()
+        get_s3_client(access_key, secret_key)
+        cached_client_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"Client construction: {new_client_ms:.1f} ms new, {cached_client_ms:.3f} ms cached")
+
+        with tempfile.NamedTemporaryFile(suffix=".bin") as payload:
+            for _ in range(options["size_mb"]):
+                payload.write(os.urandom(MB))
+            payload.flush()
+
+            for chunksize_mb in options["chunksize_mb"]:
+                for concurrency in options["concurrency"]:
+                    self.run_case(s3_client, options["bucket"], payload.name, options["size_mb"],
+                                  chunksize_mb, concurrency, options["runs"])
+
+    def run_case(self, s3_client, bucket, file_name, size_mb, chunksize_mb, concurrency, runs):
+        timings = []
+        for _ in range(runs):
+            key = f"bench/{uuid.uuid4()}.bin"
+            started = time.perf_counter()
+            resumable_upload(s3_client, file_name, bucket, key, content_type="application/octet-stream",
+                             chunksize=chunksize_mb * MB, max_concurrency=concurrency)
+            timings.append(time.perf_counter() - started)
+            s3_client.delete_object(Bucket=bucket, Key=key)
+
+        best = min(timings)
+        self.stdout.write(
+            f"chunksize={chunksize_mb:>4} MB concurrency={concurrency:>3}: "
+            f"best {size_mb / best:8.1f} MB/s, mean {size_mb * runs / sum(timings):8.1f} MB/s"
+        )
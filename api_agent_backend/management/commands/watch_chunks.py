@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from api_agent_backend.chunk_ingest import watch_chunks
+
+
+class Command(BaseCommand):
+    help = "Probe and normalize recording chunks as soon as they land in the upload folders."
+
+    def handle(self, *args, **options):
+        watch_chunks()
@@ -1,64 +1,811 @@
 
+import os
+import json
+import queue
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+import random
 import subprocess
+import tempfile
 import ffmpeg
 from decouple import config
+from filelock import FileLock, Timeout
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from api_agent_backend.chunk_manifest import (
+    manifest_lock, load_manifest, save_manifest, delete_manifest, current_entry, file_signature,
+)
+from api_agent_backend.encoder_profiles import get_profile
 
 
 UPLOAD_ROOT = Path(config('UPLOAD_ROOT'))
 OUTPUT_ROOT = Path(config('OUTPUT_ROOT'))
 
-def has_audio(file_path: Path) -> bool:
+# "auto" stream-copies sessions whose chunks share codec, resolution and
+# framerate and only transcodes the rest; "transcode" always re-encodes via
+# norm_*.mp4 files; "single_pass" scales and concatenates every chunk in one
+# ffmpeg filter graph without intermediate files.
+MERGE_MODES = ("auto", "transcode", "single_pass")
+MERGE_MODE = config('MERGE_MODE', default='auto')
+
+# Output raster, quality and speed of re-encoding merges come from an encoder
+# profile (see encoder_profiles.py). Normalized chunks are intermediates that
+# the final encode compresses again, so they are written fast and close to
+# lossless.
+NORMALIZE_PRESET = "ultrafast"
+NORMALIZE_CRF = 18
+AUDIO_SAMPLE_RATE = 48000
+
+# Probe fields that must be equal for chunks to be stream-copied together.
+# Profile and level stand in for the SPS/extradata: the concat demuxer keeps
+# the first chunk's, so a chunk encoded differently copies without error but
+# decodes with artifacts.
+COPY_KEYS = (
+    "video_codec", "video_profile", "video_level", "width", "height", "pix_fmt", "fps", "video_time_base",
+    "audio_codec", "sample_rate", "sample_fmt", "channels", "channel_layout",
+)
+
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+# Normalization runs one ffmpeg process per chunk. FFMPEG_MAX_PROCS caps how many
+# of them run at once on this host, across every Celery merge child and the
+# chunk watcher: the slots are lock files in FFMPEG_SLOT_DIR, so all processes
+# sharing that directory share the limit. NORMALIZE_WORKERS is the fan-out of a
+# single session (0 sizes it from FFMPEG_MAX_PROCS).
+FFMPEG_MAX_PROCS = config('FFMPEG_MAX_PROCS', default=CPU_COUNT, cast=int)
+FFMPEG_SLOT_DIR = Path(config('FFMPEG_SLOT_DIR', default=str(Path(tempfile.gettempdir()) / "ffmpeg_slots")))
+NORMALIZE_WORKERS = config('NORMALIZE_WORKERS', default=0, cast=int)
+NORMALIZE_THREADS = config('NORMALIZE_THREADS', default=1, cast=int)
+
+
+class HostSemaphore:
+    """
+    Counting semaphore shared by every process on the host, made of `slots`
+    lock files. A slot is held by an flock, so the kernel frees it when its
+    process dies. Used as a context manager from any thread.
+    """
+
+    def __init__(self, directory: Path, slots: int):
+        self.directory = directory
+        self.slots = max(1, slots)
+        self.held = threading.local()
+
+    def __enter__(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        while True:
+            for slot in random.sample(range(self.slots), self.slots):
+                lock = FileLock(str(self.directory / f"slot{slot}.lock"))
+                try:
+                    lock.acquire(timeout=0)
+                except Timeout:
+                    continue
+                self.held.__dict__.setdefault("locks", []).append(lock)
+                return self
+            time.sleep(0.1)
+
+    def __exit__(self, *exc):
+        self.held.locks.pop().release()
+
+
+ffmpeg_slots = HostSemaphore(FFMPEG_SLOT_DIR, FFMPEG_MAX_PROCS)
+
+# Keys of an ffmpeg -progress report (everything else on stderr is log output).
+PROGRESS_KEYS = {
+    "frame", "fps", "stream_0_0_q", "bitrate", "total_size", "out_time_us", "out_time_ms",
+    "out_time", "dup_frames", "drop_frames", "speed", "progress",
+}
+
+# HLS packaging (merge_chunks(hls_dir=...)): target segment length and
+# segment container, "fmp4" (CMAF) or "mpegts" for older players.
+HLS_SEGMENT_SECONDS = config('HLS_SEGMENT_SECONDS', default=6, cast=int)
+HLS_SEGMENT_TYPE = config('HLS_SEGMENT_TYPE', default='fmp4')
+HLS_PLAYLIST_NAME = "index.m3u8"
+
+# Preview thumbnails (merge_chunks(preview_dir=...)): one frame every
+# THUMBNAIL_INTERVAL seconds, scaled to THUMBNAIL_WIDTH and tiled into
+# sprite sheets of THUMBNAIL_COLUMNS x THUMBNAIL_ROWS, plus an index JSON
+# describing the sheets and the keyframes of the merged video.
+THUMBNAIL_INTERVAL = config('THUMBNAIL_INTERVAL', default=10, cast=int)
+THUMBNAIL_WIDTH = config('THUMBNAIL_WIDTH', default=160, cast=int)
+THUMBNAIL_COLUMNS = 10
+THUMBNAIL_ROWS = 10
+SPRITE_PATTERN = "sprite_%03d.jpg"
+PREVIEW_INDEX_NAME = "preview.json"
+
+# Speech track for transcription (merge_chunks(audio_path=...)): mono 16 kHz,
+# the rate speech recognizers resample to anyway. "opus" is a fraction of
+# the size of the MP4; "flac" is lossless for recognizers that want it.
+TRANSCRIPT_AUDIO_FORMAT = config('TRANSCRIPT_AUDIO_FORMAT', default='opus')
+TRANSCRIPT_AUDIO_SAMPLE_RATE = 16000
+TRANSCRIPT_AUDIO_EXTENSIONS = {"opus": ".ogg", "flac": ".flac"}
+
+# monitor_and_merge: merge threads, the most sessions waiting for one, and
+# how often UPLOAD_ROOT is rescanned for done.txt markers whose event was
+# missed (queue full, inotify overflow).
+MONITOR_WORKERS = config('MONITOR_WORKERS', default=2, cast=int)
+MONITOR_QUEUE_SIZE = config('MONITOR_QUEUE_SIZE', default=100, cast=int)
+MONITOR_RESCAN_SECONDS = config('MONITOR_RESCAN_SECONDS', default=60, cast=int)
+
+def probe_chunk(file_path: Path) -> dict:
+    """
+    Return the stream parameters used to plan a merge: the COPY_KEYS that must
+    match for a stream copy, plus duration and audio presence.
+    """
+    probe = ffmpeg.probe(str(file_path))
+    streams = probe.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    return {
+        "video_codec": video.get("codec_name") if video else None,
+        "video_profile": video.get("profile") if video else None,
+        "video_level": video.get("level") if video else None,
+        "width": video.get("width") if video else None,
+        "height": video.get("height") if video else None,
+        "pix_fmt": video.get("pix_fmt") if video else None,
+        "fps": video.get("r_frame_rate") if video else None,
+        "video_time_base": video.get("time_base") if video else None,
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "sample_rate": audio.get("sample_rate") if audio else None,
+        "sample_fmt": audio.get("sample_fmt") if audio else None,
+        "channels": audio.get("channels") if audio else None,
+        "channel_layout": audio.get("channel_layout") if audio else None,
+        "has_audio": audio is not None,
+        "duration": float(probe["format"]["duration"]) if probe.get("format", {}).get("duration") else None,
+    }
+
+
+def streams_match(probe: dict, reference: dict) -> bool:
+    return all(probe.get(key) == reference.get(key) for key in COPY_KEYS)
+
+
+def probe_entry(chunk: Path) -> dict:
+    """
+    Manifest entry for a chunk: its size and mtime (the cache key) plus the
+    probe result, or the probe error if ffprobe could not read it.
+    """
+    entry = file_signature(chunk)
     try:
-        probe = ffmpeg.probe(str(file_path))
-        streams = probe.get("streams", [])
-        for stream in streams:
-            if stream.get("codec_type") == "audio":
-                return True
+        entry["probe"] = probe_chunk(chunk)
+    except Exception as e:
+        entry["probe"] = None
+        entry["error"] = str(e)
+    return entry
+
+
+def probe_chunks(input_folder: Path, chunks):
+    """
+    Return manifest entries for every chunk, probing only the chunks that are
+    new or changed since they were last recorded. Probes run in parallel and
+    the results are written back to the session manifest, so the merge
+    planner and any later retry reuse them instead of probing again.
+    The caller must hold the session's manifest_lock.
+    """
+    manifest = load_manifest(input_folder)
+    entries = [current_entry(manifest, chunk) for chunk in chunks]
+    # Probes recorded before a field joined COPY_KEYS are redone.
+    missing = [
+        i for i, entry in enumerate(entries)
+        if entry is None or (entry.get("probe") and not set(COPY_KEYS) <= entry["probe"].keys())
+    ]
+
+    if missing:
+        workers = max(1, min(FFMPEG_MAX_PROCS, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            probed = list(pool.map(probe_entry, [chunks[i] for i in missing]))
+        for i, entry in zip(missing, probed):
+            entries[i] = entry
+            manifest["chunks"][chunks[i].name] = entry
+        save_manifest(input_folder, manifest)
+        print(f"Probed {len(missing)} of {len(chunks)} chunks in {input_folder}")
+
+    for chunk, entry in zip(chunks, entries):
+        if entry.get("error"):
+            print(f"Probe failed for {chunk}: {entry['error']}")
+
+    return entries
+
+
+def can_stream_copy(entries) -> bool:
+    """
+    Check whether every chunk probed cleanly and shares the same stream parameters.
+    """
+    probes = [entry.get("probe") for entry in entries]
+    if any(probe is None for probe in probes):
         return False
-    except Exception:
+
+    first = probes[0]
+    if first["video_codec"] is None:
         return False
+    return all(streams_match(probe, first) for probe in probes[1:])
 
 
-def normalize_chunk(chunk_path: Path, output_path: Path):
+def output_args(output_path: Path, sink=None, hls_dir: Path = None, faststart: bool = False, encode: bool = True):
     """
-    Normalize video resolution, fps, and codec for safe merging.
+    Output arguments for the final merge: a local file, or fragmented MP4 on
+    stdout when a streaming sink consumes the bytes as they are produced.
+
+    With hls_dir, the same encode is also packaged as HLS segments and a VOD
+    playlist in hls_dir through the tee muxer, so no second pass is needed.
+    Encoded outputs then get a keyframe every HLS_SEGMENT_SECONDS so every
+    segment can start on one.
     """
+    if sink is not None:
+        movflags = "frag_keyframe+empty_moov+default_base_moof"
+        target = "pipe:1"
+    else:
+        movflags = "+faststart" if faststart else None
+        target = str(output_path)
+
+    if hls_dir is None:
+        args = ["-f", "mp4"] if sink is not None else []
+        if movflags:
+            args.extend(["-movflags", movflags])
+        return [*args, target]
+
+    segment_ext = "m4s" if HLS_SEGMENT_TYPE == "fmp4" else "ts"
+    mp4_options = "f=mp4" + (f":movflags={movflags}" if movflags else "")
+    hls_options = ":".join([
+        "f=hls",
+        f"hls_time={HLS_SEGMENT_SECONDS}",
+        "hls_playlist_type=vod",
+        f"hls_segment_type={HLS_SEGMENT_TYPE}",
+        f"hls_segment_filename={hls_dir / f'segment_%05d.{segment_ext}'}",
+    ])
+    args = []
+    if encode:
+        args.extend(["-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})"])
+    args.extend([
+        "-flags", "+global_header",
+        "-f", "tee",
+        f"[{mp4_options}]{target}|[{hls_options}]{hls_dir / HLS_PLAYLIST_NAME}"
+    ])
+    return args
+
+
+def reset_output_dir(directory: Path):
+    """
+    Create an HLS or preview directory, dropping files left by an earlier or
+    failed attempt so only the current run's output gets uploaded.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    for leftover in directory.iterdir():
+        leftover.unlink()
+
+
+def thumbnail_filter() -> str:
+    return (
+        f"fps=1/{THUMBNAIL_INTERVAL},scale={THUMBNAIL_WIDTH}:-2,"
+        f"tile={THUMBNAIL_COLUMNS}x{THUMBNAIL_ROWS}"
+    )
+
+
+def sprite_output_args(preview_dir: Path):
+    return ["-c:v", "mjpeg", "-q:v", "5", "-f", "image2", str(preview_dir / SPRITE_PATTERN)]
+
+
+def with_thumbnails(filter_complex: str) -> str:
+    """
+    Split the [outv] of a merge filter graph so the same decoded frames also
+    feed the sprite sheets as [sprite].
+    """
+    return (
+        filter_complex.replace("[outv]", "[mergedv]", 1)
+        + f";[mergedv]split=2[outv][thumbv];[thumbv]{thumbnail_filter()}[sprite]"
+    )
+
+
+def transcript_audio_args(audio_path: Path):
+    codec = ["-c:a", "libopus", "-b:a", "24k"] if TRANSCRIPT_AUDIO_FORMAT == "opus" else ["-c:a", "flac"]
+    return ["-vn", "-ac", "1", "-ar", str(TRANSCRIPT_AUDIO_SAMPLE_RATE), *codec, str(audio_path)]
+
+
+def with_transcript_audio(filter_complex: str) -> str:
+    """
+    Split the [outa] of a merge filter graph so the same decoded audio also
+    feeds the transcription track as [speech].
+    """
+    return (
+        filter_complex.replace("[outa]", "[mergeda]", 1)
+        + ";[mergeda]asplit=2[outa][speech]"
+    )
+
+
+def keyframe_times(video_path: Path):
+    """
+    Timestamps of the video keyframes, read from the container's packets
+    without decoding anything.
+    """
+    probe = ffmpeg.probe(str(video_path), select_streams="v:0", show_entries="packet=pts_time,flags")
+    return [
+        round(float(packet["pts_time"]), 3)
+        for packet in probe.get("packets", [])
+        if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A")
+    ]
+
+
+def write_preview_index(preview_dir: Path, output_path: Path = None):
+    """
+    Describe the sprite sheets in preview_dir, and the keyframes of the
+    merged file when it was written locally, in PREVIEW_INDEX_NAME. Previews
+    are secondary output, so failing to index them does not fail the merge.
+    """
+    try:
+        sheets = sorted(path.name for path in preview_dir.glob("sprite_*.jpg"))
+        thumbnail_height = None
+        if sheets:
+            streams = ffmpeg.probe(str(preview_dir / sheets[0]))["streams"]
+            sheet = next(stream for stream in streams if stream.get("codec_type") == "video")
+            thumbnail_height = sheet["height"] // THUMBNAIL_ROWS
+        index = {
+            "interval": THUMBNAIL_INTERVAL,
+            "thumbnail_width": THUMBNAIL_WIDTH,
+            "thumbnail_height": thumbnail_height,
+            "columns": THUMBNAIL_COLUMNS,
+            "rows": THUMBNAIL_ROWS,
+            "sheets": sheets,
+            "keyframes": keyframe_times(output_path) if output_path is not None else None,
+        }
+        (preview_dir / PREVIEW_INDEX_NAME).write_text(json.dumps(index))
+    except Exception as e:
+        print(f"Could not index previews in {preview_dir}: {e}")
+
+
+def parse_progress(report: dict):
+    """
+    Return (encoded media seconds, speed factor) from one ffmpeg -progress block.
+    """
+    out_time_us = report.get("out_time_us", "")
+    speed = report.get("speed", "").rstrip("x").strip()
+    try:
+        out_time = int(out_time_us) / 1_000_000
+    except ValueError:
+        out_time = None
+    try:
+        speed = float(speed) or None
+    except ValueError:
+        speed = None
+    return out_time, speed
+
+
+def ffmpeg_progress(progress, stage: str, total_duration):
+    """
+    Adapt a merge progress callback to run_ffmpeg's on_progress, turning
+    encoded media time into percent done and an ETA in seconds.
+    """
+    if progress is None:
+        return None
+
+    def on_progress(out_time, speed):
+        percent = eta = None
+        if total_duration and out_time is not None:
+            percent = min(100.0, 100.0 * out_time / total_duration)
+            if speed:
+                eta = max(0.0, (total_duration - out_time) / speed)
+        progress(stage, percent, eta)
+
+    return on_progress
+
+
+def run_ffmpeg(command, cwd=None, sink=None, on_progress=None):
+    """
+    Run ffmpeg and return (returncode, stderr).
+
+    With a sink, ffmpeg's stdout is passed to sink.consume() while encoding
+    is still running; the sink is completed only if ffmpeg exits cleanly and
+    aborted otherwise, so a crashed encode never publishes a truncated file.
+    With on_progress, ffmpeg writes -progress reports to stderr and
+    on_progress(out_time_seconds, speed) is called for each of them.
+    """
+    if on_progress is not None:
+        command = [command[0], "-progress", "pipe:2", "-nostats", *command[1:]]
+
+    process = subprocess.Popen(
+        command, cwd=cwd,
+        stdout=subprocess.PIPE if sink is not None else subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    log_lines = []
+
+    def read_stderr():
+        report = {}
+        for raw_line in process.stderr:
+            line = raw_line.decode(errors="replace").rstrip("\n")
+            key, separator, value = line.partition("=")
+            if on_progress is None or not separator or key not in PROGRESS_KEYS:
+                log_lines.append(line)
+                continue
+            report[key] = value.strip()
+            if key == "progress":
+                try:
+                    on_progress(*parse_progress(report))
+                except Exception as e:
+                    print(f"Progress callback failed: {e}")
+                report = {}
+
+    stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+    stderr_reader.start()
+
+    if sink is not None:
+        try:
+            sink.consume(process.stdout)
+        except Exception as e:
+            process.kill()
+            process.wait()
+            stderr_reader.join()
+            sink.abort()
+            return 1, f"Streaming upload to {sink} failed: {e}"
+
+    returncode = process.wait()
+    stderr_reader.join()
+    stderr = "\n".join(log_lines)
+
+    if sink is None:
+        return returncode, stderr
+
+    if returncode != 0:
+        sink.abort()
+        return returncode, stderr
+
+    try:
+        sink.complete()
+    except Exception as e:
+        sink.abort()
+        return 1, f"Completing upload to {sink} failed: {e}"
+    return returncode, stderr
+
+
+def concat_copy(chunks, output_path: Path, input_folder: Path, sink=None, on_progress=None, hls_dir: Path = None,
+                preview_dir: Path = None, audio_path: Path = None):
+    """
+    Remux chunks with the concat demuxer without re-encoding. Sprite sheets
+    for preview_dir are made from the keyframes alone, the only frames that
+    get decoded.
+    """
+    for directory in (hls_dir, preview_dir):
+        if directory is not None:
+            reset_output_dir(directory)
+
+    list_file = input_folder / "concat.txt"
+    lines = []
+    for chunk in chunks:
+        escaped = str(chunk.resolve()).replace("'", "'\\''")
+        lines.append(f"file '{escaped}'\n")
+    list_file.write_text("".join(lines))
+
     command = [
-        "ffmpeg", "-y", "-i", str(chunk_path),
-        "-vf", "scale=1600:900,fps=15",
+        "ffmpeg", "-y",
+        "-f", "concat", "-safe", "0",
+        "-protocol_whitelist", "file,http,https,tcp,tls,crypto",
+        *(["-skip_frame", "nokey"] if preview_dir is not None else []),
+        "-i", str(list_file),
+        # Explicit, since the tee muxer has no default stream selection and
+        # the sprite output must not take streams from the video output.
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c", "copy",
+        *output_args(output_path, sink, hls_dir, faststart=True, encode=False)
+    ]
+    if preview_dir is not None:
+        command.extend(["-map", "0:v:0", "-vf", thumbnail_filter(), *sprite_output_args(preview_dir)])
+    if audio_path is not None:
+        command.extend(["-map", "0:a:0", *transcript_audio_args(audio_path)])
+    try:
+        return run_ffmpeg(command, sink=sink, on_progress=on_progress)
+    finally:
+        list_file.unlink()
+
+
+def remove_merged_inputs(input_folder: Path, original_chunks):
+    # Chunks in S3 (S3Chunk) are the only copy of the recording until the
+    # merged file is stored, so merge_pipeline deletes them after the upload.
+    for file in original_chunks:
+        if isinstance(file, Path):
+            file.unlink()
+
+    # Normalized at ingest time but not needed by a copy or single-pass merge.
+    for leftover in input_folder.glob("norm_*.mp4"):
+        leftover.unlink()
+
+    done_file = input_folder / "done.txt"
+    if done_file.exists():
+        done_file.unlink()
+
+    delete_manifest(input_folder)
+
+
+def normalized_path(chunk: Path) -> Path:
+    return chunk.parent / f"norm_{chunk.stem}.mp4"
+
+
+def encode_args(profile: dict, audio_present: bool):
+    """
+    Codec arguments of the final encode for an encoder profile.
+    """
+    args = [
         "-c:v", "libx264",
+        "-preset", profile["preset"],
+        "-crf", str(profile["crf"]),
+        "-threads", str(profile["threads"]),
         "-pix_fmt", "yuv420p",
-        "-preset", "ultrafast",
-        str(output_path)
+        "-r", str(profile["fps"]),
     ]
+    if audio_present:
+        args.extend(["-c:a", "aac", "-b:a", profile["audio_bitrate"]])
+    return args
+
+
+def normalize_chunk(chunk_path: Path, output_path: Path, add_silence: bool = False, profile: dict = None):
+    """
+    Normalize video resolution, fps, and codec for safe merging. add_silence
+    gives a chunk without audio a silent track so it can be concatenated with
+    chunks that have one.
+    """
+    profile = profile or get_profile()
+    command = ["ffmpeg", "-y", "-i", str(chunk_path)]
+    if add_silence:
+        command.extend([
+            "-f", "lavfi", "-i", f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl=stereo",
+            "-map", "0:v:0", "-map", "1:a:0", "-shortest",
+        ])
+    command.extend([
+        "-vf", f"scale={profile['width']}:{profile['height']},fps={profile['fps']}",
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-preset", NORMALIZE_PRESET,
+        "-crf", str(NORMALIZE_CRF),
+        "-threads", str(NORMALIZE_THREADS),
+        str(output_path)
+    ])
     result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if result.returncode != 0:
         raise RuntimeError(f"Failed to normalize {chunk_path.name}: {result.stderr.decode()}")
 
 
+def normalize_chunks(chunks, ready=(), add_silence=(), progress=None, profile: dict = None):
+    """
+    Normalize chunks on a bounded worker pool, keeping their order and
+    stopping the remaining work at the first failure. Chunks whose names are
+    in ready were already normalized at ingest time and are skipped; those in
+    add_silence get a silent audio track.
+    """
+    outputs = [normalized_path(chunk) for chunk in chunks]
+    pending = [i for i, chunk in enumerate(chunks) if chunk.name not in ready]
+    if not pending:
+        return outputs
+
+    workers = max(1, min(NORMALIZE_WORKERS or FFMPEG_MAX_PROCS, len(pending)))
+    failed = threading.Event()
+
+    def run(i):
+        with ffmpeg_slots:
+            if failed.is_set():
+                return
+            normalize_chunk(chunks[i], outputs[i], chunks[i].name in add_silence, profile)
 
-def merge_chunks(input_folder: Path, output_path: Path):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, i) for i in pending]
+        try:
+            for completed, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if progress is not None:
+                    progress("normalizing", 100.0 * completed / len(futures), None)
+        except Exception:
+            failed.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+    return outputs
+
+
+
+def single_pass_command(chunks, entries, output_path: Path, sink=None, hls_dir: Path = None, profile: dict = None,
+                        preview_dir: Path = None, audio_path: Path = None):
+    """
+    Build one ffmpeg command that scales, resamples and concatenates every
+    chunk in a single decode-encode pass. Chunks without audio get silence of
+    their own duration when other chunks carry audio.
+    """
+    profile = profile or get_profile()
+    for chunk, entry in zip(chunks, entries):
+        if entry.get("probe") is None:
+            raise RuntimeError(f"Cannot merge {chunk.name}: {entry.get('error')}")
+    probes = [entry["probe"] for entry in entries]
+    audio_present = any(probe["has_audio"] for probe in probes)
+
+    input_args = []
+    filters = []
+    concat_inputs = ""
+
+    for idx, (chunk, probe) in enumerate(zip(chunks, probes)):
+        input_args.extend(["-i", str(chunk)])
+        filters.append(
+            f"[{idx}:v:0]scale={profile['width']}:{profile['height']},fps={profile['fps']},"
+            f"format=yuv420p,setsar=1[v{idx}]"
+        )
+        concat_inputs += f"[v{idx}]"
+
+        if not audio_present:
+            continue
+        if probe["has_audio"]:
+            filters.append(
+                f"[{idx}:a:0]aresample={AUDIO_SAMPLE_RATE},"
+                f"aformat=sample_fmts=fltp:channel_layouts=stereo[a{idx}]"
+            )
+        elif probe["duration"]:
+            filters.append(
+                f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl=stereo,"
+                f"atrim=duration={probe['duration']},aformat=sample_fmts=fltp[a{idx}]"
+            )
+        else:
+            raise RuntimeError(f"{chunk.name} has no audio and no known duration")
+        concat_inputs += f"[a{idx}]"
+
+    concat = f"{concat_inputs}concat=n={len(chunks)}:v=1"
+    concat += ":a=1[outv][outa]" if audio_present else ":a=0[outv]"
+    filters.append(concat)
+
+    filter_complex = ";".join(filters)
+    if preview_dir is not None:
+        filter_complex = with_thumbnails(filter_complex)
+    if audio_path is not None and audio_present:
+        filter_complex = with_transcript_audio(filter_complex)
+
+    command = [
+        "ffmpeg", "-y",
+        *input_args,
+        "-filter_complex", filter_complex,
+        "-map", "[outv]"
+    ]
+    if audio_present:
+        command.extend(["-map", "[outa]"])
+    command.extend([
+        *encode_args(profile, audio_present),
+        *output_args(output_path, sink, hls_dir)
+    ])
+    if preview_dir is not None:
+        command.extend(["-map", "[sprite]", *sprite_output_args(preview_dir)])
+    if audio_path is not None and audio_present:
+        command.extend(["-map", "[speech]", *transcript_audio_args(audio_path)])
+    return command
+
+
+def chunk_number(chunk) -> int:
+    return int(''.join(filter(str.isdigit, chunk.stem)))
+
+
+def merge_chunks(input_folder: Path, output_path: Path, mode: str = None, sink=None, progress=None, chunks=None,
+                 hls_dir: Path = None, profile: str = None, preview_dir: Path = None, audio_path: Path = None):
+    """
+    Merge a session's chunks into output_path, or, when a sink is given,
+    stream the merged MP4 into it instead of writing a local file (see
+    run_ffmpeg for the sink interface).
+
+    chunks defaults to the chunk*.mp4 files in input_folder. Chunks stored
+    elsewhere (see s3_chunks.S3Chunk) can be passed instead; input_folder is
+    then only the working folder for the manifest and normalized files.
+
+    hls_dir, if given, additionally receives HLS segments and an index.m3u8
+    playlist of the merged video, written by the same ffmpeg run.
+
+    profile names the encoder profile used when the merge re-encodes; it
+    defaults to ENCODER_PROFILE.
+
+    preview_dir, if given, receives thumbnail sprite sheets made from the
+    frames the merge decodes anyway, and a PREVIEW_INDEX_NAME JSON index.
+
+    audio_path, if given, receives a mono TRANSCRIPT_AUDIO_FORMAT speech
+    track from the same run. It is not written when no chunk has audio.
+
+    progress, if given, is called as progress(stage, percent, eta_seconds)
+    with stage one of "probing", "remuxing", "normalizing" or "encoding";
+    percent and eta_seconds are None when they cannot be estimated.
+    """
+    mode = mode or MERGE_MODE
+    if mode not in MERGE_MODES:
+        return False, f"Unknown merge mode: {mode}"
+
+    try:
+        encoder_profile = get_profile(profile)
+    except ValueError as e:
+        return False, str(e)
+
+    if not input_folder.is_dir():
+        return False, f"No chunks found in {input_folder}"
+
+    # Held for the whole merge so the chunk watcher does not write norm_*
+    # files or the manifest while they are being consumed.
+    with manifest_lock(input_folder):
+        return _merge_chunks(
+            input_folder, output_path, mode, sink, progress, chunks, hls_dir, encoder_profile, preview_dir,
+            audio_path
+        )
+
+
+def _merge_chunks(input_folder: Path, output_path: Path, mode: str, sink=None, progress=None, chunks=None,
+                  hls_dir: Path = None, profile: dict = None, preview_dir: Path = None,
+                  audio_path: Path = None):
     original_chunks = sorted(
-        input_folder.glob("chunk*.mp4"),
-        key=lambda f: int(''.join(filter(str.isdigit, f.stem)))
+        input_folder.glob("chunk*.mp4") if chunks is None else chunks,
+        key=chunk_number
     )
 
     if not original_chunks:
         return False, f"No chunks found in {input_folder}"
 
-    print(f"Merging {input_folder} into {output_path}")
+    destination = output_path if sink is None else sink
+    print(f"Merging {input_folder} into {destination} (mode={mode}, profile={profile['name']})")
 
-    audio_present = has_audio(original_chunks[0])
-    normalized_chunks = []
+    if progress is not None:
+        progress("probing", None, None)
+    entries = probe_chunks(input_folder, original_chunks)
+
+    durations = [entry["probe"]["duration"] if entry.get("probe") else None for entry in entries]
+    total_duration = sum(durations) if all(durations) else None
+
+    if audio_path is not None:
+        audio_path.unlink(missing_ok=True)
+        if not any(entry.get("probe") and entry["probe"]["has_audio"] for entry in entries):
+            audio_path = None
+
+    if mode == "auto" and can_stream_copy(entries):
+        returncode, stderr = concat_copy(
+            original_chunks, output_path, input_folder, sink,
+            on_progress=ffmpeg_progress(progress, "remuxing", total_duration),
+            hls_dir=hls_dir, preview_dir=preview_dir, audio_path=audio_path
+        )
+        if returncode == 0:
+            if preview_dir is not None:
+                write_preview_index(preview_dir, output_path if sink is None else None)
+            remove_merged_inputs(input_folder, original_chunks)
+            return True, f"Merged successfully to {destination} (stream copy)"
+        print(f"Stream copy failed for {input_folder}, falling back to transcoding: {stderr}")
+
+    if mode == "single_pass":
+        try:
+            command = single_pass_command(
+                original_chunks, entries, output_path, sink, hls_dir, profile, preview_dir, audio_path
+            )
+        except Exception as e:
+            return False, str(e)
+
+        for directory in (hls_dir, preview_dir):
+            if directory is not None:
+                reset_output_dir(directory)
+
+        returncode, stderr = run_ffmpeg(
+            command, cwd=input_folder, sink=sink,
+            on_progress=ffmpeg_progress(progress, "encoding", total_duration)
+        )
+        if returncode != 0:
+            return False, stderr
+
+        if preview_dir is not None:
+            write_preview_index(preview_dir, output_path if sink is None else None)
+        remove_merged_inputs(input_folder, original_chunks)
+        return True, f"Merged successfully to {destination} (single pass)"
+
+    has_audio = {
+        chunk.name: bool(entry.get("probe") and entry["probe"]["has_audio"])
+        for chunk, entry in zip(original_chunks, entries)
+    }
+    audio_present = any(has_audio.values())
+    add_silence = {name for name, present in has_audio.items() if audio_present and not present}
+
+    ready = {
+        chunk.name for chunk, entry in zip(original_chunks, entries)
+        if entry.get("normalized") and entry.get("profile") == profile["name"]
+        and normalized_path(chunk).exists() and chunk.name not in add_silence
+    }
 
     try:
-        for i, chunk in enumerate(original_chunks):
-            norm_path = input_folder / f"norm_{i}.mp4"
-            normalize_chunk(chunk, norm_path)
-            normalized_chunks.append(norm_path)
+        normalized_chunks = normalize_chunks(original_chunks, ready, add_silence, progress, profile)
     except Exception as e:
+        for leftover in input_folder.glob("norm_*.mp4"):
+            leftover.unlink()
         return False, str(e)
 
     input_args = []
@@ -73,6 +820,10 @@ def merge_chunks(input_folder: Path, output_path: Path):
 
     filter_complex += f"concat=n={len(normalized_chunks)}:v=1"
     filter_complex += ":a=1[outv][outa]" if audio_present else ":a=0[outv]"
+    if preview_dir is not None:
+        filter_complex = with_thumbnails(filter_complex)
+    if audio_path is not None and audio_present:
+        filter_complex = with_transcript_audio(filter_complex)
 
     command = [
         "ffmpeg",
@@ -85,48 +836,136 @@ def merge_chunks(input_folder: Path, output_path: Path):
         command.extend(["-map", "[outa]"])
 
     command.extend([
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-r", "30",
+        *encode_args(profile, audio_present),
         "-y",  
-        str(output_path)
+        *output_args(output_path, sink, hls_dir)
     ])
+    if preview_dir is not None:
+        command.extend(["-map", "[sprite]", *sprite_output_args(preview_dir)])
+    if audio_path is not None and audio_present:
+        command.extend(["-map", "[speech]", *transcript_audio_args(audio_path)])
+
+    for directory in (hls_dir, preview_dir):
+        if directory is not None:
+            reset_output_dir(directory)
 
-    result = subprocess.run(command, cwd=input_folder, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    returncode, stderr = run_ffmpeg(
+        command, cwd=input_folder, sink=sink,
+        on_progress=ffmpeg_progress(progress, "encoding", total_duration)
+    )
 
     
     for file in normalized_chunks:
         file.unlink()
 
-    if result.returncode != 0:
-        return False, result.stderr.decode()
+    if returncode != 0:
+        return False, stderr
 
-    
-    for file in original_chunks:
-        file.unlink()
+    if preview_dir is not None:
+        write_preview_index(preview_dir, output_path if sink is None else None)
+    remove_merged_inputs(input_folder, original_chunks)
 
-    done_file = input_folder / "done.txt"
-    if done_file.exists():
-        done_file.unlink()
+    return True, f"Merged successfully to {destination}"
 
-    return True, f"Merged successfully to {output_path}"
 
+class DoneFileHandler(FileSystemEventHandler):
+    """
+    Queues a session folder as soon as its done.txt marker is created.
+    """
 
-def monitor_and_merge():
-    while True:
-        print("Scanning for ready-to-merge folders...")
-        for user_folder in UPLOAD_ROOT.glob("user_*"):
-            if not user_folder.is_dir():
-                continue
+    def __init__(self, enqueue):
+        self.enqueue = enqueue
+
+    def on_created(self, event):
+        self.check(Path(event.src_path))
+
+    def on_moved(self, event):
+        self.check(Path(event.dest_path))
+
+    def check(self, path: Path):
+        user_folder = path.parent
+        if path.name == "done.txt" and user_folder.parent == UPLOAD_ROOT and user_folder.name.startswith("user_"):
+            self.enqueue(user_folder)
+
+
+def merged_path(user_folder: Path) -> Path:
+    return OUTPUT_ROOT / f"{user_folder.name}_merged.mp4"
 
-            done_file = user_folder / "done.txt"
-            merged_file = OUTPUT_ROOT / f"{user_folder.name}_merged.mp4"
 
-            if done_file.exists() and not merged_file.exists():
-                success, message = merge_chunks(user_folder, merged_file)
-                if success:
-                    print(f" {message}")
-                else:
-                    print(f" Merge failed: {message}")
+def ready_folders():
+    for user_folder in UPLOAD_ROOT.glob("user_*"):
+        if (user_folder.is_dir() and (user_folder / "done.txt").exists()
+                and not merged_path(user_folder).exists()):
+            yield user_folder
 
-        time.sleep(10)  
+
+def merge_ready_folder(user_folder: Path):
+    done_file = user_folder / "done.txt"
+    merged_file = merged_path(user_folder)
+
+    if done_file.exists() and not merged_file.exists():
+        success, message = merge_chunks(user_folder, merged_file)
+        if success:
+            print(f" {message}")
+        else:
+            print(f" Merge failed: {message}")
+
+
+def monitor_and_merge(workers: int = MONITOR_WORKERS):
+    """
+    Merge user_* folders under UPLOAD_ROOT as soon as their done.txt appears.
+
+    Folders are pushed onto a bounded queue served by `workers` merge
+    threads. The watchdog thread never blocks on a full queue: the folder is
+    dropped and picked up by the rescan that runs at startup and every
+    MONITOR_RESCAN_SECONDS, which also catches events inotify lost.
+    """
+    work = queue.Queue(maxsize=MONITOR_QUEUE_SIZE)
+    queued = set()
+    queued_lock = threading.Lock()
+
+    def enqueue(user_folder: Path):
+        with queued_lock:
+            if user_folder in queued:
+                return
+            queued.add(user_folder)
+        try:
+            work.put_nowait(user_folder)
+        except queue.Full:
+            with queued_lock:
+                queued.discard(user_folder)
+            print(f"Merge queue full, {user_folder} will be picked up by the next rescan.")
+
+    def worker():
+        while True:
+            user_folder = work.get()
+            try:
+                merge_ready_folder(user_folder)
+            except Exception as e:
+                print(f" Merge failed: {e}")
+            finally:
+                # Stays in `queued` until merged, so a rescan cannot queue it twice.
+                with queued_lock:
+                    queued.discard(user_folder)
+                work.task_done()
+
+    for _ in range(workers):
+        threading.Thread(target=worker, daemon=True).start()
+
+    UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
+    observer = Observer()
+    observer.schedule(DoneFileHandler(enqueue), str(UPLOAD_ROOT), recursive=True)
+    observer.start()
+
+    print("Scanning for ready-to-merge folders...")
+    next_scan = 0
+    try:
+        while observer.is_alive():
+            if time.monotonic() >= next_scan:
+                for user_folder in ready_folders():
+                    enqueue(user_folder)
+                next_scan = time.monotonic() + MONITOR_RESCAN_SECONDS
+            time.sleep(1)
+    finally:
+        observer.stop()
+        observer.join()
@@ -0,0 +1,278 @@
+from pathlib import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from api_agent_backend.merg_chunks import (
+    merge_chunks, PREVIEW_INDEX_NAME, TRANSCRIPT_AUDIO_FORMAT, TRANSCRIPT_AUDIO_EXTENSIONS,
+)
+from api_agent_backend.merge_status import set_merge_status, stream_progress
+from api_agent_backend.s3_chunks import list_s3_chunks, delete_s3_chunks
+from api_agent_backend.Upload_S3 import upload_video_to_s3, upload_directory_to_s3, store_video_urls_in_db, S3StreamUpload
+
+
+BASE_DIR = Path(config('BASE_DIR'))
+
+BUCKET_NAME = config('BUCKET_NAME')
+AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
+AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
+
+# Upload the merged video while ffmpeg is still encoding instead of writing
+# final_<session>.mp4 to disk first.
+MERGE_STREAM_UPLOAD = config('MERGE_STREAM_UPLOAD', default=False, cast=bool)
+
+# How long a merge waits for a stream's upload folder to appear.
+FOLDER_WAIT_TIMEOUT = config('FOLDER_WAIT_TIMEOUT', default=10, cast=float)
+
+# "local": chunks are uploaded to this server under BASE_DIR/uploads and
+# BASE_DIR/screen_uploads. "s3": the browser PUTs them to S3 through
+# presigned URLs and any merge worker reads them from there.
+CHUNK_STORAGE = config('CHUNK_STORAGE', default='local')
+S3_MERGE_WORK_DIR = BASE_DIR / "s3_merges"
+
+# Also publish each merged stream as HLS under <session>/<folder_type>/hls/,
+# so reviewers can start playback and seek without fetching the whole MP4.
+# Can be overridden per merge request.
+MERGE_HLS = config('MERGE_HLS', default=False, cast=bool)
+
+# Thumbnail sprite sheets and a keyframe index, made from the frames the
+# merge decodes anyway and published under <session>/<folder_type>/preview/.
+MERGE_PREVIEWS = config('MERGE_PREVIEWS', default=True, cast=bool)
+
+# A mono speech track of the camera stream for the evaluation service's
+# transcription, stored in interview_evaluations.audio_uploads.
+MERGE_TRANSCRIPT_AUDIO = config('MERGE_TRANSCRIPT_AUDIO', default=True, cast=bool)
+
+class FolderCreatedHandler(FileSystemEventHandler):
+    def __init__(self, path, appeared):
+        self.path = path
+        self.appeared = appeared
+
+    def on_any_event(self, event):
+        if self.path.exists():
+            self.appeared.set()
+
+def wait_for_folder(path, timeout=FOLDER_WAIT_TIMEOUT):
+    """
+    Wait for path to exist, woken by a filesystem event on its parent instead
+    of polling, so the merge starts as soon as the folder is created.
+    """
+    if path.exists():
+        print(f"Folder found: {path}")
+        return True
+
+    print(f"Waiting up to {timeout}s for folder: {path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    appeared = threading.Event()
+    observer = Observer()
+    observer.schedule(FolderCreatedHandler(path, appeared), str(path.parent), recursive=False)
+    observer.start()
+    try:
+        # Checked again after the watch is in place so a folder created in
+        # between is not missed.
+        if path.exists() or appeared.wait(timeout):
+            print(f"Folder found: {path}")
+            return True
+        return False
+    finally:
+        observer.stop()
+        observer.join()
+
+def publish_outputs(session_id, stream, folder_type, hls_dir=None, preview_dir=None):
+    """
+    Upload the HLS rendition and preview sprites written next to a merged
+    stream and record their index URLs (hls_url, preview_url) in the merge
+    status. The MP4 is the primary output, so a failed upload here is logged
+    and does not fail the merge.
+    """
+    outputs = [
+        (hls_dir, "hls", ".m3u8", "hls_url"),
+        (preview_dir, "preview", PREVIEW_INDEX_NAME, "preview_url"),
+    ]
+    for directory, subfolder, index_suffix, status_field in outputs:
+        if directory is None or not directory.is_dir():
+            continue
+        index_url = upload_directory_to_s3(
+            directory, BUCKET_NAME, session_id, folder_type, subfolder, index_suffix,
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+        )
+        if index_url:
+            set_merge_status(session_id, stream, **{status_field: index_url})
+            directory.rmdir()
+
+def publish_transcript_audio(session_id, stream, folder_type, audio_file):
+    """
+    Upload the speech track written next to a merged stream and return its
+    URL, or None if there is none or the upload failed.
+    """
+    if audio_file is None or not audio_file.exists():
+        return None
+    audio_url = upload_video_to_s3(
+        file_name=str(audio_file),
+        bucket_name=BUCKET_NAME,
+        session_id=session_id,
+        folder_type=folder_type,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+    )
+    if audio_url:
+        set_merge_status(session_id, stream, audio_url=audio_url)
+    return audio_url
+
+def merge_and_upload(session_id, stream, input_path, folder_type, merge_mode=None, hls=False, profile=None):
+    """
+    Wait for one stream's folder, merge its chunks and upload the result,
+    returning (video URL, speech track URL), either of them None if missing.
+    Progress is recorded under `stream` in the session's merge status, along
+    with the HLS, preview and audio URLs.
+    """
+    url, audio_url = _merge_and_upload(session_id, stream, input_path, folder_type, merge_mode, hls, profile)
+    if url:
+        set_merge_status(session_id, stream, status="done", stage="done", percent=100.0, eta_seconds=0, url=url)
+    else:
+        set_merge_status(session_id, stream, status="failed", eta_seconds=None)
+    return url, audio_url
+
+def _merge_and_upload(session_id, stream, input_path, folder_type, merge_mode=None, hls=False, profile=None):
+    set_merge_status(session_id, stream, status="running", stage="waiting_for_chunks", percent=None, eta_seconds=None)
+
+    if CHUNK_STORAGE == "s3":
+        # The local folder only holds the manifest, normalized chunks and the merged file.
+        input_path = S3_MERGE_WORK_DIR / f"{session_id}_{stream}"
+        input_path.mkdir(parents=True, exist_ok=True)
+        chunks = list_s3_chunks(
+            BUCKET_NAME, session_id, folder_type, input_path,
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+        )
+        print(f"Found {len(chunks)} chunks in S3 for {session_id}/{folder_type}")
+    else:
+        print(f"Checking for folder: {input_path}")
+        if not wait_for_folder(input_path):
+            print(f"Folder not found after {FOLDER_WAIT_TIMEOUT}s: {input_path}. Skipping {folder_type}.")
+            return None, None
+        chunks = None
+
+    progress = stream_progress(session_id, stream)
+    output_file = input_path / f"final_{session_id}.mp4"
+    hls_dir = input_path / "hls" if hls else None
+    preview_dir = input_path / "preview" if MERGE_PREVIEWS else None
+    audio_file = None
+    if MERGE_TRANSCRIPT_AUDIO and stream == "camera":
+        audio_file = input_path / f"audio_{session_id}{TRANSCRIPT_AUDIO_EXTENSIONS[TRANSCRIPT_AUDIO_FORMAT]}"
+
+    if MERGE_STREAM_UPLOAD:
+        sink = S3StreamUpload(
+            bucket_name=BUCKET_NAME,
+            session_id=session_id,
+            folder_type=folder_type,
+            file_name=output_file.name,
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+        )
+        success, msg = merge_chunks(
+            input_path, None, mode=merge_mode, sink=sink, progress=progress, chunks=chunks,
+            hls_dir=hls_dir, profile=profile, preview_dir=preview_dir, audio_path=audio_file
+        )
+        print(f"Merging {folder_type}: Success={success}, Message='{msg}'")
+        if not success:
+            return None, None
+        if chunks:
+            delete_s3_chunks(chunks)
+        publish_outputs(session_id, stream, folder_type, hls_dir, preview_dir)
+        return sink.url, publish_transcript_audio(session_id, stream, folder_type, audio_file)
+
+    has_chunks = bool(chunks) if chunks is not None else any(input_path.glob("chunk*.mp4"))
+    if output_file.exists() and not has_chunks:
+        # An earlier attempt merged the chunks but did not finish uploading;
+        # upload_video_to_s3 resumes from its checkpoint.
+        print(f"Found merged file from an earlier attempt: {output_file}")
+        success = True
+    else:
+        success, msg = merge_chunks(
+            input_path, output_file, mode=merge_mode, progress=progress, chunks=chunks,
+            hls_dir=hls_dir, profile=profile, preview_dir=preview_dir, audio_path=audio_file
+        )
+        print(f"Merging {folder_type}: Success={success}, Message='{msg}'")
+
+    if not success:
+        print(f"Merging failed for {folder_type}. Skipping upload.")
+        return None, None
+
+    set_merge_status(session_id, stream, stage="uploading", percent=None, eta_seconds=None)
+
+    publish_outputs(session_id, stream, folder_type, hls_dir, preview_dir)
+    audio_url = publish_transcript_audio(session_id, stream, folder_type, audio_file)
+
+    s3_video_file_url = upload_video_to_s3(
+        file_name=str(output_file),
+        bucket_name=BUCKET_NAME,
+        session_id=session_id,
+        folder_type=folder_type,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+    )
+    if s3_video_file_url:
+        print(f"Video uploaded to S3 ({folder_type}): {s3_video_file_url}")
+        if chunks:
+            delete_s3_chunks(chunks)
+    return s3_video_file_url, audio_url
+
+def process_merge_and_upload(session_id, merge_mode=None, hls=None, profile=None):
+    try:
+        hls = MERGE_HLS if hls is None else hls
+        print("\nInside process_merge_and_upload function")
+        print(f"Session ID: {session_id}, merge mode: {merge_mode or 'default'}, hls: {hls}, profile: {profile or 'default'}")
+        set_merge_status(session_id, "session", status="running")
+ 
+        session_id_screen = session_id + "_screen"
+ 
+        paths = {
+            "screen": {
+                "input": BASE_DIR / "screen_uploads" / session_id_screen,
+                "folder_type": "screen_uploads"
+            },
+            "camera": {
+                "input": BASE_DIR / "uploads" / session_id,
+                "folder_type": "Camera_uploads"
+            }
+        }
+ 
+        # The screen and camera streams are independent until the DB write,
+        # so the session takes as long as the slower of the two.
+        with ThreadPoolExecutor(max_workers=len(paths)) as stream_pool:
+            futures = {
+                val["folder_type"]: stream_pool.submit(
+                    merge_and_upload, session_id, key, val["input"], val["folder_type"], merge_mode, hls, profile
+                )
+                for key, val in paths.items()
+            }
+
+        urls = {}
+        audio_urls = {}
+        for folder_type, future in futures.items():
+            try:
+                urls[folder_type], audio_urls[folder_type] = future.result()
+            except Exception as e:
+                print(f"Merge and upload failed for {folder_type} of session_id={session_id}: {e}")
+                urls[folder_type] = audio_urls[folder_type] = None
+
+        screen_url = urls["screen_uploads"]
+        camera_url = urls["Camera_uploads"]
+        audio_url = audio_urls["Camera_uploads"]
+ 
+        if screen_url or camera_url:
+            print(f"Storing URLs in database: screen_url={screen_url}, camera_url={camera_url}, audio_url={audio_url}")
+            store_video_urls_in_db(session_id, screen_url=screen_url, camera_url=camera_url, audio_url=audio_url)
+            set_merge_status(session_id, "session", status="done")
+        else:
+            print(f"No videos to store for session_id: {session_id}")
+            set_merge_status(session_id, "session", status="failed")
+ 
+    except Exception as e:
+        print(f"Exception in process_merge_and_upload for session_id={session_id}: {str(e)}")
+        set_merge_status(session_id, "session", status="failed", error=str(e))
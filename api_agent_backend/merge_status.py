@@ -0,0 +1,53 @@
+import json
+import time
+
+from decouple import config
+from redis.exceptions import RedisError
+
+from api_agent_backend.redis_client import get_redis
+
+
+# Status of finished sessions stays readable for this long.
+MERGE_STATUS_TTL = config('MERGE_STATUS_TTL', default=24 * 60 * 60, cast=int)
+
+
+def status_key(session_id):
+    return f"merge:status:{session_id}"
+
+
+def set_merge_status(session_id, stream, **fields):
+    """
+    Update the status of one stream ("screen", "camera") or of the whole
+    session ("session"). Fields not passed keep their previous value.
+    Status is best effort: a Redis outage must not fail the merge itself.
+    """
+    try:
+        redis_client = get_redis()
+        key = status_key(session_id)
+        current = json.loads(redis_client.hget(key, stream) or "{}")
+        current.update(fields)
+        current["updated_at"] = time.time()
+        redis_client.hset(key, stream, json.dumps(current))
+        redis_client.expire(key, MERGE_STATUS_TTL)
+    except RedisError as e:
+        print(f"Could not record merge status for {session_id}/{stream}: {e}")
+
+
+def get_merge_status(session_id):
+    raw = get_redis().hgetall(status_key(session_id))
+    return {stream: json.loads(value) for stream, value in raw.items()}
+
+
+def stream_progress(session_id, stream):
+    """
+    progress callback for merge_chunks that records stage, percent and ETA.
+    """
+    def progress(stage, percent, eta):
+        set_merge_status(
+            session_id, stream,
+            status="running",
+            stage=stage,
+            percent=round(percent, 1) if percent is not None else None,
+            eta_seconds=round(eta) if eta is not None else None,
+        )
+    return progress
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_agent_backend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interviewevaluation',
+            name='audio_uploads',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
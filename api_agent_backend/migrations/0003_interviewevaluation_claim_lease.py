@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_agent_backend', '0002_interviewevaluation_audio_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interviewevaluation',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='interviewevaluation',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='interviewevaluation',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='ie_status_lease_idx'),
+        ),
+    ]
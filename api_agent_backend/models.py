@@ -22,11 +22,18 @@ class InterviewEvaluation(models.Model):
     status = models.CharField(max_length=255, null=True, blank=True)
     Camera_uploads = models.TextField(null=True, blank=True)
     screen_uploads = models.TextField(null=True, blank=True)
+    audio_uploads = models.TextField(null=True, blank=True)
+    # Dispatcher that moved the row to DISPATCHING, and when its claim lapses.
+    claimed_by = models.CharField(max_length=255, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'interview_evaluations'
+        indexes = [
+            models.Index(fields=['status', 'lease_expires_at'], name='ie_status_lease_idx'),
+        ]
         constraints = [
             models.CheckConstraint(check=models.Q(performance_score__gte=0, performance_score__lte=100),
                                    name='performance_score_between_0_and_100')
@@ -0,0 +1,242 @@
+from decouple import config
+
+
+# Sessions claimed per round of queries. A claimed batch has to be sent
+# within EVALUATION_LEASE_SECONDS at the dispatch rate, or another worker
+# takes it over.
+PENDING_BATCH_SIZE = config('PENDING_BATCH_SIZE', default=50, cast=int)
+
+# How long a claimed session stays DISPATCHING before another dispatcher
+# may take it over, e.g. after the claiming worker crashed.
+EVALUATION_LEASE_SECONDS = config('EVALUATION_LEASE_SECONDS', default=15 * 60, cast=int)
+
+
+def placeholders(values) -> str:
+    return ", ".join(["%s"] * len(values))
+
+
+def claim_pending_sessions(conn, owner, after_id, limit, lease_seconds):
+    """
+    Move up to `limit` PENDING sessions with a camera upload, oldest first
+    after interview_evaluations.id after_id, to DISPATCHING under owner.
+    Rows with an expired DISPATCHING lease are taken over as well. Rows
+    another dispatcher is claiming right now are skipped rather than waited
+    for (needs MySQL 8.0). Returns the ids of the claimed rows and the last
+    id examined.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT ie.id, ie.session_id, ie.status
+            FROM interview_evaluations ie
+            WHERE ie.id > %s AND ie.Camera_uploads != ""
+              AND (ie.status = 'PENDING'
+                   OR (ie.status = 'DISPATCHING' AND ie.lease_expires_at < UTC_TIMESTAMP()))
+              AND NOT EXISTS (
+                  SELECT 1 FROM interview_evaluations processed
+                  WHERE processed.session_id = ie.session_id AND processed.status = 'PROCESSED'
+              )
+            ORDER BY ie.id ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (after_id, limit))
+        rows = cursor.fetchall()
+        if rows:
+            ids = [row["id"] for row in rows]
+            cursor.execute(f"""
+                UPDATE interview_evaluations
+                SET status = 'DISPATCHING', claimed_by = %s,
+                    lease_expires_at = UTC_TIMESTAMP() + INTERVAL %s SECOND
+                WHERE id IN ({placeholders(ids)})
+            """, (owner, lease_seconds, *ids))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    for row in rows:
+        if row["status"] == 'DISPATCHING':
+            print(f"Taking over session {row['session_id']} after its dispatch lease expired.")
+    return [row["id"] for row in rows], rows[-1]["id"] if rows else after_id
+
+
+def load_claimed_sessions(cursor, ids):
+    """
+    Claimed rows with their upload links and batch_id.
+    """
+    cursor.execute(f"""
+        SELECT ie.id, ie.session_id, ie.Camera_uploads, ie.audio_uploads, lb.batch_id
+        FROM interview_evaluations ie
+        LEFT JOIN lipsync_openaiid_batchid lb ON lb.openai_session_id = ie.session_id
+        WHERE ie.id IN ({placeholders(ids)})
+        ORDER BY ie.id ASC
+    """, tuple(ids))
+    return cursor.fetchall()
+
+
+def renew_claims(conn, owner, ids, lease_seconds=EVALUATION_LEASE_SECONDS):
+    """
+    Extend owner's lease on rows it still holds. Returns how many it still
+    holds; 0 means the lease expired and another dispatcher took them over.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE interview_evaluations
+            SET lease_expires_at = UTC_TIMESTAMP() + INTERVAL %s SECOND
+            WHERE id IN ({placeholders(ids)}) AND status = 'DISPATCHING' AND claimed_by = %s
+        """, (lease_seconds, *ids, owner))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def release_claims(conn, owner, ids):
+    """
+    Put rows claimed by owner back to PENDING.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE interview_evaluations
+            SET status = 'PENDING', claimed_by = NULL, lease_expires_at = NULL
+            WHERE id IN ({placeholders(ids)}) AND status = 'DISPATCHING' AND claimed_by = %s
+        """, (*ids, owner))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def load_jobs(cursor, batch_ids):
+    """
+    job_id, webhook URL and skills for each batch_id.
+    """
+    if not batch_ids:
+        return {}
+    cursor.execute(f"""
+        SELECT s.batch_id, s.job_id, s.webhook_url, j.technical_skills, j.focus_skills
+        FROM student_job_data s
+        LEFT JOIN job_details j ON j.job_id = s.job_id
+        WHERE s.batch_id IN ({placeholders(batch_ids)})
+    """, tuple(batch_ids))
+    jobs = {}
+    for row in cursor.fetchall():
+        jobs.setdefault(row["batch_id"], row)
+    return jobs
+
+
+def load_tabswitch_counts(cursor, session_ids):
+    """
+    Latest tab switch and fullscreen exit counts of each session.
+    """
+    cursor.execute(f"""
+        SELECT t.session_id, t.tabswitch_count, t.fullscreen_exit_count
+        FROM tabswitch_data t
+        JOIN (
+            SELECT MAX(id) AS id
+            FROM tabswitch_data
+            WHERE session_id IN ({placeholders(session_ids)})
+            GROUP BY session_id
+        ) latest ON latest.id = t.id
+    """, tuple(session_ids))
+    return {row["session_id"]: row for row in cursor.fetchall()}
+
+
+def load_detection_counts(cursor, session_ids):
+    """
+    Frames with more than one person and frames with a phone, per session.
+    """
+    cursor.execute(f"""
+        SELECT openai_session_id,
+               COUNT(CASE WHEN person_count > 1 THEN 1 END) AS multi_person_count,
+               COUNT(CASE WHEN cell_phone_detected = 1 THEN 1 END) AS cell_phone_count
+        FROM detected_images
+        WHERE openai_session_id IN ({placeholders(session_ids)})
+        GROUP BY openai_session_id
+    """, tuple(session_ids))
+    return {row["openai_session_id"]: row for row in cursor.fetchall()}
+
+
+def claim_pending_batch(conn, owner, after_id=0, limit=PENDING_BATCH_SIZE,
+                        lease_seconds=EVALUATION_LEASE_SECONDS):
+    """
+    Claim up to `limit` pending sessions after interview_evaluations.id
+    after_id for owner and load everything their evaluation payload needs.
+    Returns (evaluations, last id seen); each evaluation holds the keyword
+    arguments of task.build_payload except get_uuid, plus claim_ids, the
+    rows claimed for its session. Sessions without a batch_id or job are
+    logged and released back to PENDING.
+    """
+    ids, last_id = claim_pending_sessions(conn, owner, after_id, limit, lease_seconds)
+    if not ids:
+        return [], last_id
+
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    try:
+        claimed = load_claimed_sessions(cursor, ids)
+
+        # A session can appear once per batch_id row; the first one wins.
+        unique = {}
+        for session in claimed:
+            unique.setdefault(session["session_id"], session)
+        sessions = list(unique.values())
+        session_ids = [session["session_id"] for session in sessions]
+
+        jobs = load_jobs(cursor, list({session["batch_id"] for session in sessions if session["batch_id"] is not None}))
+        tabswitches = load_tabswitch_counts(cursor, session_ids)
+        detections = load_detection_counts(cursor, session_ids)
+    finally:
+        cursor.close()
+    conn.commit()
+
+    evaluations = []
+    skipped = set()
+    for session in sessions:
+        session_id = session["session_id"]
+        if session["batch_id"] is None:
+            print(f"Error: No batch_id found for session ID {session_id}.")
+            skipped.add(session_id)
+            continue
+        job = jobs.get(session["batch_id"])
+        if not job or not job["job_id"]:
+            print("No job_id found for batch_id:", session["batch_id"])
+            skipped.add(session_id)
+            continue
+
+        tabswitch = tabswitches.get(session_id, {})
+        detection = detections.get(session_id, {})
+        evaluations.append({
+            "claim_ids": sorted({row["id"] for row in claimed if row["session_id"] == session_id}),
+            "session_id": session_id,
+            "batch_id": session["batch_id"],
+            "upload_link": session["Camera_uploads"],
+            "audio_link": session["audio_uploads"],
+            "skills_raw": job["technical_skills"],
+            "focus_skills_raw": job["focus_skills"],
+            "tabswitch_count": tabswitch.get("tabswitch_count", 0),
+            "fullscreen_exit_count": tabswitch.get("fullscreen_exit_count", 0),
+            "multi_person_count": detection.get("multi_person_count", 0),
+            "cell_phone_count": detection.get("cell_phone_count", 0),
+            "server_url": job["webhook_url"],
+        })
+
+    if skipped:
+        release_claims(conn, owner, list({row["id"] for row in claimed if row["session_id"] in skipped}))
+    return evaluations, last_id
+
+
+def iter_pending_evaluations(conn, owner, batch_size=PENDING_BATCH_SIZE):
+    """
+    Claim and yield every pending evaluation, batch_size sessions at a time.
+    A batch is only claimed once the previous one has been consumed.
+    """
+    after_id = 0
+    while True:
+        evaluations, last_id = claim_pending_batch(conn, owner, after_id, batch_size)
+        if last_id == after_id:
+            return
+        yield from evaluations
+        after_id = last_id
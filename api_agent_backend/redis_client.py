@@ -0,0 +1,20 @@
+import redis
+from decouple import config
+from django.conf import settings
+
+
+# Defaults to the Celery broker so no extra Redis has to be deployed.
+REDIS_URL = config('REDIS_URL', default=settings.CELERY_BROKER_URL)
+
+_client = None
+
+
+def get_redis():
+    """
+    Process-wide Redis client. redis-py pools connections per process and
+    resets the pool after a fork, so this is safe in Celery prefork workers.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
@@ -0,0 +1,150 @@
+import threading
+import time
+
+import jwt
+import requests
+from decouple import config
+from redis.exceptions import LockError, RedisError
+
+from api_agent_backend import http_client
+from api_agent_backend.redis_client import get_redis
+
+
+REPORT_TOKEN_KEY = "report_api:access_token"
+REPORT_TOKEN_REFRESH_LOCK = "report_api:access_token:refresh"
+
+# Tokens are refreshed this many seconds before their exp claim. Tokens
+# without an exp claim are kept for REPORT_TOKEN_DEFAULT_TTL seconds.
+REPORT_TOKEN_REFRESH_MARGIN = config('REPORT_TOKEN_REFRESH_MARGIN', default=60, cast=int)
+REPORT_TOKEN_DEFAULT_TTL = config('REPORT_TOKEN_DEFAULT_TTL', default=300, cast=int)
+
+# Longest a login may take, retries included. It is also the lifetime of the
+# refresh lock and how long other workers wait for the login to finish.
+REPORT_TOKEN_LOGIN_TIMEOUT = config('REPORT_TOKEN_LOGIN_TIMEOUT', default=60, cast=int)
+
+_local_lock = threading.Lock()
+_cached = {"token": None, "expires_at": 0.0}
+
+
+def token_expiry(token: str) -> float:
+    """
+    When the token should be refreshed, from its exp claim. The signature is
+    not checked: the report API does that, we only need the timestamp.
+    """
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        claims = {}
+    if "exp" in claims:
+        return float(claims["exp"]) - REPORT_TOKEN_REFRESH_MARGIN
+    return time.time() + REPORT_TOKEN_DEFAULT_TTL
+
+
+def login_timeout():
+    """
+    (connect, read) timeout per login attempt that keeps every attempt
+    http_client makes, plus its worst-case backoff, within
+    REPORT_TOKEN_LOGIN_TIMEOUT, so the refresh lock outlives the login.
+    """
+    attempts = http_client.HTTP_MAX_RETRIES + 1
+    backoff = sum(
+        min(http_client.HTTP_BACKOFF_MAX, http_client.HTTP_BACKOFF_BASE * 2 ** attempt)
+        for attempt in range(http_client.HTTP_MAX_RETRIES)
+    )
+    # 10% headroom for the Redis round trips around the login.
+    per_attempt = max(1.0, (REPORT_TOKEN_LOGIN_TIMEOUT * 0.9 - backoff) / attempts)
+    connect = min(http_client.HTTP_CONNECT_TIMEOUT, per_attempt / 2)
+    return connect, per_attempt - connect
+
+
+def login():
+    """
+    Log in to REPORT_ACCESS_TOKEN_API with the report user. Returns the
+    access token or None.
+    """
+    payload = {
+        'username': config('REPORT_USER_NAME'),
+        'password': config('REPORT_PASSWORD'),
+    }
+    try:
+        response = http_client.post(config('REPORT_ACCESS_TOKEN_API'), json=payload, timeout=login_timeout())
+        response.raise_for_status()
+        access_token = response.json().get('access')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print("HTTP Request failed:", e)
+        return None
+    if not access_token:
+        print("Access token not found in response.")
+        return None
+    print("Access token received.")
+    return access_token
+
+
+def remember(token):
+    _cached["token"] = token
+    _cached["expires_at"] = token_expiry(token)
+
+
+def cached_token(stale=None):
+    """
+    Local copy of the token if it is still fresh and is not `stale`.
+    """
+    token = _cached["token"]
+    if token and token != stale and time.time() < _cached["expires_at"]:
+        return token
+    return None
+
+
+def shared_token(redis_client, stale=None):
+    token = redis_client.get(REPORT_TOKEN_KEY)
+    if token and token != stale and time.time() < token_expiry(token):
+        return token
+    return None
+
+
+def refresh_shared_token(redis_client, stale=None):
+    """
+    Log in once for all workers: the first one takes the refresh lock, the
+    others wait for it and then pick up the token it stored.
+    """
+    lock = redis_client.lock(REPORT_TOKEN_REFRESH_LOCK, timeout=REPORT_TOKEN_LOGIN_TIMEOUT,
+                             blocking_timeout=REPORT_TOKEN_LOGIN_TIMEOUT)
+    if not lock.acquire():
+        return shared_token(redis_client, stale)
+    try:
+        token = shared_token(redis_client, stale)
+        if token:
+            return token
+        token = login()
+        if token:
+            ttl = int(token_expiry(token) - time.time())
+            if ttl > 0:
+                redis_client.set(REPORT_TOKEN_KEY, token, ex=ttl)
+        return token
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
+
+
+def get_access_token(stale=None):
+    """
+    Bearer token for the report API, shared by every thread and worker
+    through Redis and renewed shortly before it expires. Pass the token a
+    request was rejected with as `stale` to force a new one. Without Redis
+    each process logs in on its own. Returns None if login fails.
+    """
+    with _local_lock:
+        token = cached_token(stale)
+        if token:
+            return token
+        try:
+            redis_client = get_redis()
+            token = shared_token(redis_client, stale) or refresh_shared_token(redis_client, stale)
+        except RedisError as e:
+            print(f"Redis unavailable for the report token, logging in directly: {e}")
+            token = login()
+        if token:
+            remember(token)
+        return token
@@ -0,0 +1,66 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+from api_agent_backend.Upload_S3 import (
+    S3_PRESIGN_GET_EXPIRES, get_s3_client, list_chunk_objects,
+)
+
+
+class S3Chunk:
+    """
+    A recording chunk stored in S3, standing in for a local chunk Path in
+    merge_chunks. ffmpeg reads it through a presigned GET URL, seeking with
+    HTTP range requests instead of downloading it first, so any merge worker
+    can merge any session.
+    """
+
+    def __init__(self, s3_client, bucket_name, obj, work_folder: Path):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = obj["Key"]
+        self.size = obj["Size"]
+        self.etag = obj["ETag"].strip('"')
+        self.name = self.key.rsplit("/", 1)[-1]
+        self.stem = Path(self.name).stem
+        # Normalized copies and the manifest live in the local work folder.
+        self.parent = work_folder
+        self.url = s3_client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket_name, "Key": self.key},
+            ExpiresIn=S3_PRESIGN_GET_EXPIRES,
+        )
+
+    def __str__(self):
+        return self.url
+
+    def resolve(self):
+        return self
+
+    def exists(self):
+        return True
+
+    def stat(self):
+        # The manifest caches probes by size and mtime; an object's ETag
+        # changes whenever its content does, so it takes the mtime's place.
+        return SimpleNamespace(st_size=self.size, st_mtime_ns=self.etag)
+
+    def unlink(self):
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=self.key)
+
+
+def delete_s3_chunks(chunks):
+    """
+    Delete merged chunks from S3. Only call once the merged file is stored.
+    """
+    for chunk in chunks:
+        try:
+            chunk.unlink()
+        except Exception as e:
+            print(f"Could not delete s3://{chunk.bucket_name}/{chunk.key}: {e}")
+
+
+def list_s3_chunks(bucket_name, session_id, folder_type, work_folder: Path,
+                   aws_access_key_id=None, aws_secret_access_key=None):
+    s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key)
+    objects = list_chunk_objects(bucket_name, session_id, folder_type, aws_access_key_id, aws_secret_access_key)
+    return [S3Chunk(s3_client, bucket_name, obj, work_folder) for obj in objects]
@@ -0,0 +1,216 @@
+import json
+import shutil
+import socket
+import time
+from pathlib import Path
+
+from decouple import config
+from filelock import Timeout
+from redis.exceptions import RedisError
+
+from api_agent_backend.chunk_manifest import manifest_lock
+from api_agent_backend.merge_pipeline import BASE_DIR, S3_MERGE_WORK_DIR
+from api_agent_backend.merge_status import get_merge_status
+from api_agent_backend.redis_client import get_redis
+
+
+GB = 1024 ** 3
+
+# Session folders live under these roots, keyed by the stream they hold.
+SPOOL_ROOTS = {
+    "camera": BASE_DIR / "uploads",
+    "screen": BASE_DIR / "screen_uploads",
+    "s3_work": S3_MERGE_WORK_DIR,
+}
+
+# Bytes the session folders may use in total. 0 allows SPOOL_DISK_FRACTION
+# of the filesystem holding BASE_DIR.
+SPOOL_BUDGET_GB = config('SPOOL_BUDGET_GB', default=0, cast=float)
+SPOOL_DISK_FRACTION = config('SPOOL_DISK_FRACTION', default=0.8, cast=float)
+
+# New merges are refused while the spool is over budget or the disk has less
+# than this much free space.
+SPOOL_MIN_FREE_GB = config('SPOOL_MIN_FREE_GB', default=5, cast=float)
+
+# A session folder nothing has written to for this long, and that no merge
+# is queued or running for, is considered abandoned.
+SPOOL_ABANDONED_HOURS = config('SPOOL_ABANDONED_HOURS', default=24, cast=float)
+
+# Merge workers publish their spool usage to this Redis hash, one field per
+# host, whenever they check for room. Reports older than SPOOL_USAGE_TTL
+# seconds are treated as gone.
+SPOOL_USAGE_KEY = "spool:usage"
+SPOOL_USAGE_TTL = config('SPOOL_USAGE_TTL', default=60 * 60, cast=int)
+
+
+def session_for_folder(kind: str, folder: Path):
+    """
+    Return (session_id, stream) for a session folder: uploads/<sid>,
+    screen_uploads/<sid>_screen or s3_merges/<sid>_<stream>.
+    """
+    if kind == "camera":
+        return folder.name, "camera"
+    if kind == "screen":
+        return folder.name.removesuffix("_screen"), "screen"
+    session_id, _, stream = folder.name.rpartition("_")
+    return session_id, stream
+
+
+def folder_usage(folder: Path):
+    """
+    Return (bytes, newest mtime) of everything under folder.
+    """
+    total = 0
+    newest = folder.stat().st_mtime
+    for path in folder.rglob("*"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        newest = max(newest, stat.st_mtime)
+        if path.is_file():
+            total += stat.st_size
+    return total, newest
+
+
+def list_sessions():
+    sessions = []
+    for kind, root in SPOOL_ROOTS.items():
+        if not root.is_dir():
+            continue
+        for folder in root.iterdir():
+            if not folder.is_dir():
+                continue
+            try:
+                size, last_modified = folder_usage(folder)
+            except FileNotFoundError:
+                continue
+            session_id, stream = session_for_folder(kind, folder)
+            sessions.append({
+                "path": folder,
+                "session_id": session_id,
+                "stream": stream,
+                "bytes": size,
+                "last_modified": last_modified,
+            })
+    return sessions
+
+
+def budget_bytes() -> int:
+    if SPOOL_BUDGET_GB:
+        return int(SPOOL_BUDGET_GB * GB)
+    return int(shutil.disk_usage(BASE_DIR).total * SPOOL_DISK_FRACTION)
+
+
+def merge_pending(session_id) -> bool:
+    try:
+        redis_client = get_redis()
+        return bool(redis_client.exists(f"merge:lock:{session_id}", f"merge:queued:{session_id}"))
+    except RedisError:
+        # Without Redis we cannot tell, so assume a merge still needs the files.
+        return True
+
+
+def eviction_reason(session, now):
+    """
+    Why a session folder may be deleted ("uploaded" or "abandoned"), or None
+    if it must be kept.
+    """
+    if merge_pending(session["session_id"]):
+        return None
+    try:
+        status = get_merge_status(session["session_id"]).get(session["stream"], {})
+    except RedisError:
+        status = {}
+    if status.get("status") == "done":
+        return "uploaded"
+    if now - session["last_modified"] >= SPOOL_ABANDONED_HOURS * 3600:
+        return "abandoned"
+    return None
+
+
+def spool_usage():
+    """
+    Disk usage of the session folders on this node and whether it can take
+    another merge.
+    """
+    sessions = list_sessions()
+    used = sum(session["bytes"] for session in sessions)
+    budget = budget_bytes()
+    free = shutil.disk_usage(BASE_DIR).free
+    return {
+        "used_bytes": used,
+        "budget_bytes": budget,
+        "disk_free_bytes": free,
+        "sessions": len(sessions),
+        "accepting_merges": used < budget and free >= SPOOL_MIN_FREE_GB * GB,
+    }
+
+
+def publish_spool_usage(usage):
+    try:
+        get_redis().hset(SPOOL_USAGE_KEY, socket.gethostname(), json.dumps({**usage, "updated_at": time.time()}))
+    except RedisError as e:
+        print(f"Could not publish spool usage: {e}")
+
+
+def published_spool_usage():
+    """
+    Latest spool usage reported by each merge worker host, without scanning
+    any disk.
+    """
+    now = time.time()
+    nodes = {}
+    for host, value in get_redis().hgetall(SPOOL_USAGE_KEY).items():
+        usage = json.loads(value)
+        if now - usage["updated_at"] < SPOOL_USAGE_TTL:
+            nodes[host] = usage
+    return nodes
+
+
+def spool_has_room() -> bool:
+    usage = spool_usage()
+    publish_spool_usage(usage)
+    return usage["accepting_merges"]
+
+
+def enforce_spool_budget():
+    """
+    Delete the oldest uploaded or abandoned session folders until the spool
+    is back under budget and the disk has SPOOL_MIN_FREE_GB free. Folders a
+    merge is queued or running for, and folders still receiving chunks, are
+    never touched. Returns the number of bytes freed.
+    """
+    sessions = sorted(list_sessions(), key=lambda session: session["last_modified"])
+    used = sum(session["bytes"] for session in sessions)
+    budget = budget_bytes()
+    free = shutil.disk_usage(BASE_DIR).free
+    now = time.time()
+    freed = 0
+
+    for session in sessions:
+        if used - freed < budget and free + freed >= SPOOL_MIN_FREE_GB * GB:
+            break
+        reason = eviction_reason(session, now)
+        if reason is None:
+            continue
+
+        folder = session["path"]
+        lock = manifest_lock(folder)
+        try:
+            # Skip folders the chunk watcher or a merge is working in right now.
+            lock.acquire(timeout=0)
+        except (Timeout, FileNotFoundError):
+            continue
+        try:
+            shutil.rmtree(folder)
+        except OSError as e:
+            print(f"Could not evict {folder}: {e}")
+            continue
+        finally:
+            lock.release()
+
+        freed += session["bytes"]
+        print(f"Evicted {reason} session folder {folder} ({session['bytes'] / GB:.2f} GB)")
+
+    return freed
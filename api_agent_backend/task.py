@@ -1,189 +1,176 @@
+import os
+import socket
 import uuid
 import logging
 import mysql.connector
 import requests
 import json
-from time import sleep
-import random
 from backend.celery import app
 from decouple import config
+from django.conf import settings
+from redis.exceptions import LockError
+
+from api_agent_backend.merge_pipeline import (
+    process_merge_and_upload, BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+)
+from api_agent_backend.Upload_S3 import abort_stale_multipart_uploads
+from api_agent_backend.db_pool import get_connection
+from api_agent_backend.pending_evaluations import iter_pending_evaluations, renew_claims
+from api_agent_backend.evaluation_dispatch import dispatch
+from api_agent_backend.report_token import get_access_token
+from api_agent_backend import http_client
+from api_agent_backend.merge_status import set_merge_status
+from api_agent_backend.redis_client import get_redis
+from api_agent_backend.spool import spool_has_room, enforce_spool_budget
 
 
-DB_CONFIG = {
-    'host': config('host'),
-    'database': config('database'),
-    'user': config('user'),
-    'password': config('password'),
-    'port': config('port')
-}
-
 API_POST_URL = config('API_POST_URL')   
 
-@app.task(name="api_agent_backend.task.check_pending_evaluations")
-def check_pending_evaluations():
-    cursor = None
-    conn = None
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True, buffered=True)
-        logging.info("Checking for pending evaluations...")
-        print("Checking for pending evaluations...")
+# Longest a single session merge is expected to take. Duplicate merge
+# requests are ignored for this long, and a crashed worker's lock expires.
+# Read in settings, which derives the broker visibility timeout from it.
+MERGE_LOCK_TTL = settings.MERGE_LOCK_TTL
 
-        query = """
-        SELECT session_id FROM interview_evaluations WHERE status = 'PENDING' and Camera_uploads !="" ORDER BY id ASC
-        """
-        cursor.execute(query)
-        pending_sessions = cursor.fetchall()
-        if not pending_sessions:
-            logging.info("No pending sessions found.")
-            return
+# How long a merge waits before checking again for disk space on this node.
+SPOOL_RETRY_SECONDS = config('SPOOL_RETRY_SECONDS', default=300, cast=int)
 
-        for pending_session in pending_sessions:
-            session_id = pending_session["session_id"]
-            
-            logging.info(f"Triggering evaluation for session: {session_id}")
-            print(f"Triggering evaluation for session: {session_id}")
 
-        
-            status_query = "SELECT status FROM interview_evaluations WHERE session_id = %s"
-            cursor.execute(status_query, (session_id,))
-            session_status = cursor.fetchone()
+def enqueue_merge(session_id, merge_mode=None, hls=None, profile=None):
+    """
+    Queue a merge for session_id unless one is already queued or running.
+    Returns False for a duplicate request.
+    """
+    queued_key = f"merge:queued:{session_id}"
+    if not get_redis().set(queued_key, 1, nx=True, ex=MERGE_LOCK_TTL):
+        return False
+    try:
+        merge_session.delay(session_id, merge_mode, hls, profile)
+    except Exception:
+        get_redis().delete(queued_key)
+        raise
+    set_merge_status(session_id, "session", status="queued")
+    return True
+
+
+@app.task(name="api_agent_backend.task.merge_session", bind=True, acks_late=True,
+          reject_on_worker_lost=True, max_retries=None)
+def merge_session(self, session_id, merge_mode=None, hls=None, profile=None):
+    """
+    Merge and upload one session. Routed to the "merge" queue; run merge
+    workers with `celery -A backend worker -Q merge -c <N>` to set the
+    per-node concurrency. The message is acknowledged only once the merge has
+    finished, so a merge lost with its worker is redelivered.
+    """
+    if not spool_has_room():
+        enforce_spool_budget()
+        if not spool_has_room():
+            print(f"Not enough disk space to merge {session_id}, retrying in {SPOOL_RETRY_SECONDS}s.")
+            set_merge_status(session_id, "session", status="queued", stage="waiting_for_disk")
+            raise self.retry(countdown=SPOOL_RETRY_SECONDS)
+
+    lock = get_redis().lock(f"merge:lock:{session_id}", timeout=MERGE_LOCK_TTL)
+    if not lock.acquire(blocking=False):
+        # Redelivered while the first run, or the lock of a dead worker, is still alive.
+        raise self.retry(countdown=60)
 
-            if session_status and session_status["status"] == "PROCESSED":
-                print(f"Session {session_id} has already been processed. Skipping.")
-                return
+    try:
+        process_merge_and_upload(session_id, merge_mode, hls, profile)
+    finally:
+        get_redis().delete(f"merge:queued:{session_id}")
+        try:
+            lock.release()
+        except LockError:
+            print(f"Merge lock for {session_id} expired before the merge finished.")
 
-            fetch_batch_query = "SELECT batch_id FROM lipsync_openaiid_batchid WHERE openai_session_id = %s"
-            cursor.execute(fetch_batch_query, (session_id,))
-            batch_result = cursor.fetchone()
 
-            if batch_result is None:
-                print(f"Error: No batch_id found for session ID {session_id}.")
-                return
+@app.task(name="api_agent_backend.task.abort_stale_uploads")
+def abort_stale_uploads():
+    aborted = abort_stale_multipart_uploads(BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+    print(f"Aborted {aborted} abandoned multipart uploads in {BUCKET_NAME}.")
 
-            batch_id = batch_result["batch_id"]
-            print("Batch ID: ", batch_id)
 
-            upload_link, skills_raw, focus_skills_raw, tabswitch_count, fullscreen_exit_count, multi_person_count, cell_phone_count, server_url = get_data(session_id, batch_id)
-            get_uuid = uuid.uuid4()
+@app.task(name="api_agent_backend.task.enforce_spool_budget")
+def enforce_spool_budget_task():
+    freed = enforce_spool_budget()
+    if freed:
+        print(f"Freed {freed / 1024 ** 3:.2f} GB of session folders.")
 
-            if upload_link is None:
-                print("Error: Unable to retrieve data for the given session ID.")
-            else:
-                payload = build_payload(session_id, upload_link, skills_raw, focus_skills_raw, tabswitch_count, fullscreen_exit_count, multi_person_count, cell_phone_count, get_uuid, batch_id, server_url)
-                send_post_request(payload, session_id, cursor, conn)
 
-            cooldown_time = random.randint(10, 20)
-            print(f"Waiting for {cooldown_time} seconds before the next task...")
-            sleep(cooldown_time)
+@app.task(name="api_agent_backend.task.check_pending_evaluations")
+def check_pending_evaluations():
+    """
+    Send every pending evaluation to the report API, concurrently within the
+    limits in evaluation_dispatch. Sessions are claimed in batches before
+    they are sent, so any number of workers can run this at the same time
+    without sending a session twice.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    conn = None
+    try:
+        conn = get_connection()
+        logging.info("Checking for pending evaluations...")
+        print("Checking for pending evaluations...")
 
+        sent = dispatch(iter_pending_evaluations(conn, owner), lambda evaluation: send_evaluation(evaluation, owner))
+        if not sent:
+            logging.info("No pending sessions found.")
+        else:
+            stats = http_client.http_stats()
+            print(f"Dispatched {sent} evaluations. HTTP: {stats['requests']} responses, "
+                  f"{stats['retries']} retries, {stats['errors']} errors, "
+                  f"avg {stats['latency_avg']:.2f}s, max {stats['latency_max']:.2f}s")
 
     except mysql.connector.Error as e:
         logging.error(f"Database Error: {e}")
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
     finally:
-        if cursor:
-            cursor.close()
         if conn:
             conn.close()
 
-def get_data(session_id, batch_id):
-    conn = mysql.connector.connect(**DB_CONFIG)
+def send_evaluation(evaluation, owner):
+    evaluation = dict(evaluation)
+    claim_ids = evaluation.pop("claim_ids")
+    session_id = evaluation["session_id"]
+
+    conn = get_connection()
     cursor = conn.cursor(buffered=True)
-    print(session_id, batch_id, "=======================")
     try:
-        cursor.execute("""
-            SELECT job_id,webhook_url
-            FROM student_job_data
-            WHERE batch_id = %s
-        """, (batch_id,))
-        result = cursor.fetchone()
-        job_id = result[0] if result else None
-        server_url = result[1] if result else None
-        print("Job ID: ", job_id)
-        print("Server URL:", server_url)
-
-        if not job_id:
-            print("No job_id found for batch_id:", batch_id)
-            return (None,) * 8
-
-        print("Fetching webhook URL...")
-        # cursor.execute("""
-        #     SELECT webhook_url
-        #     FROM student_job_data
-        #     WHERE batch_id = %s
-        # """, (batch_id,))
-        # result = cursor.fetchone()
-        
-       
-
-        cursor.execute("""
-            SELECT Camera_uploads
-            FROM interview_evaluations
-            WHERE session_id = %s
-        """, (session_id,))
-        result = cursor.fetchone()
-        upload_link = result[0] if result else None
-        print("Upload Link: ", upload_link)
-
-        cursor.execute("""
-            SELECT technical_skills, focus_skills
-            FROM job_details
-            WHERE job_id = %s
-        """, (job_id,))
-        result = cursor.fetchone()
-        skills_raw, focus_skills_raw = result if result else (None, None)
-
-        cursor.execute("""
-            SELECT tabswitch_count, fullscreen_exit_count
-            FROM tabswitch_data
-            WHERE session_id = %s
-            ORDER BY id DESC
-            LIMIT 1
-        """, (session_id,))
-        result = cursor.fetchone()
-        tabswitch_count = result[0] if result else 0
-        fullscreen_exit_count = result[1] if result else 0
-
-        cursor.execute("""
-            SELECT
-                COUNT(CASE WHEN person_count > 1 THEN 1 END),
-                COUNT(CASE WHEN cell_phone_detected = 1 THEN 1 END)
-            FROM detected_images
-            WHERE openai_session_id = %s
-        """, (session_id,))
-        result = cursor.fetchone()
-        multi_person_count = result[0] if result else 0
-        cell_phone_count = result[1] if result else 0
-
-        return (upload_link, skills_raw, focus_skills_raw,
-                tabswitch_count, fullscreen_exit_count,
-                multi_person_count, cell_phone_count,
-                server_url)
+        # The batch may have waited in the rate limiter longer than its lease.
+        if not renew_claims(conn, owner, claim_ids):
+            print(f"Lost the claim on session {session_id} to another dispatcher, not sending it.")
+            return
 
+        logging.info(f"Triggering evaluation for session: {session_id}")
+        print(f"Triggering evaluation for session: {session_id}, batch ID: {evaluation['batch_id']}")
+        payload = build_payload(get_uuid=uuid.uuid4(), **evaluation)
+        send_post_request(payload, session_id, cursor, conn, owner)
     finally:
         cursor.close()
         conn.close()
 
 def build_payload(session_id, upload_link, skills_raw, focus_skills_raw,
-                  tabswitch_count, fullscreen_exit_count, multi_person_count, cell_phone_count, get_uuid, batch_id, server_url):
+                  tabswitch_count, fullscreen_exit_count, multi_person_count, cell_phone_count, get_uuid, batch_id, server_url,
+                  audio_link=None):
     def to_skill_list(skill_str):
         if not skill_str:
             return []
         return [{"skill_title": s.strip()} for s in skill_str.split(",") if s.strip()]
 
+    link = {
+        "id": str(get_uuid),
+        "link": upload_link
+    }
+    if audio_link:
+        # Mono speech track of the same recording, for transcription.
+        link["audio_link"] = audio_link
+
     return {
         "server_url": server_url,
         "batch_id": batch_id,
         'openai_id': session_id,
         "is_agent": "1",
-        "links": [
-            {
-                "id": str(get_uuid),
-                "link": upload_link
-            }
-        ],
+        "links": [link],
         "skill": to_skill_list(skills_raw),
         "focus_skill": to_skill_list(focus_skills_raw),
         "proctoring_data": [
@@ -196,7 +183,10 @@ def build_payload(session_id, upload_link, skills_raw, focus_skills_raw,
         ]
     }
 
-def send_post_request(payload, session_id, cursor, conn):
+def send_post_request(payload, session_id, cursor, conn, owner):
+    # Rows of the session this dispatcher claimed, and duplicates nobody has
+    # claimed yet; rows another dispatcher has taken over are left alone.
+    own_rows = "session_id = %s AND (claimed_by = %s OR status = 'PENDING')"
     token = get_access_token()
     if not token:
         print(f"Skipping session {session_id} due to missing access token.")
@@ -209,7 +199,13 @@ def send_post_request(payload, session_id, cursor, conn):
     print("Headers:", headers)
 
     try:
-        response = requests.post(API_POST_URL, headers=headers, data=json.dumps(payload))
+        response = http_client.post(API_POST_URL, headers=headers, data=json.dumps(payload))
+        if response.status_code == 401:
+            # Revoked or expired early: log in again once and resend.
+            token = get_access_token(stale=token)
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+                response = http_client.post(API_POST_URL, headers=headers, data=json.dumps(payload))
         print("Response Text:", response.text)
         data = response.json()
 
@@ -217,48 +213,23 @@ def send_post_request(payload, session_id, cursor, conn):
             status_value = data.get('status', '').lower()
             if status_value in ('received', 'pending'):
                 print("Request successful. Marking session as 'PROCESSING'.")
-                update_query = "UPDATE interview_evaluations SET status = 'PROCESSING' WHERE session_id = %s"
+                update_query = "UPDATE interview_evaluations SET status = 'PROCESSING' WHERE " + own_rows
             elif status_value =='processed':
                 print("Request successful. Marking session as 'processed'.")
-                update_query = "UPDATE interview_evaluations SET status = 'PROCESSED' WHERE session_id = %s"
+                update_query = "UPDATE interview_evaluations SET status = 'PROCESSED' WHERE " + own_rows
             else:
                 print("Unknown status in response. Marking session as 'FAILED'.")
-                update_query = "UPDATE interview_evaluations SET status = 'FAILED' WHERE session_id = %s"
+                update_query = "UPDATE interview_evaluations SET status = 'FAILED' WHERE " + own_rows
         else:
             print("Request failed. Marking session as 'ONETIMESEND'.")
-            update_query = "UPDATE interview_evaluations SET status = 'ONETIMESEND' WHERE session_id = %s"
+            update_query = "UPDATE interview_evaluations SET status = 'ONETIMESEND' WHERE " + own_rows
 
-        cursor.execute(update_query, (session_id,))
+        cursor.execute(update_query, (session_id, owner))
         conn.commit()
 
     except requests.exceptions.RequestException as e:
         print(f"HTTP Request failed: {e}")
         print("Marking session as 'FAILED'.")
-        update_query = "UPDATE interview_evaluations SET status = 'FAILED' WHERE session_id = %s"
-        cursor.execute(update_query, (session_id,))
+        update_query = "UPDATE interview_evaluations SET status = 'FAILED' WHERE " + own_rows
+        cursor.execute(update_query, (session_id, owner))
         conn.commit()
-
-
-def get_access_token():
-    username=config('REPORT_USER_NAME')
-    password=config('REPORT_PASSWORD')
-    api_url=config('REPORT_ACCESS_TOKEN_API')
-    payload = {
-        'username': username,
-        'password': password
-    }
-    try:
-        response = requests.post(api_url, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        access_token = data.get('access')
-        if access_token:
-            print("Access token received:", access_token)
-            return access_token
-        else:
-            print("Access token not found in response.")
-            return None
- 
-    except requests.exceptions.RequestException as e:
-        print("HTTP Request failed:", e)
-        return None
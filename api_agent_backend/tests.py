@@ -1,2 +1,84 @@
-from django.test import TestCase
-
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from api_agent_backend import http_client
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.server.hits.append((self.path, self.client_address))
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/unavailable":
+            self.reply(503, b"unavailable")
+        elif self.path == "/slow":
+            time.sleep(1)
+            self.reply(200, b"late")
+        else:
+            self.reply(200, b"ok")
+
+    def reply(self, code, body):
+        try:
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.hits = []
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        http_client._reset_session()
+        patches = [
+            mock.patch.object(http_client, "HTTP_MAX_RETRIES", 2),
+            mock.patch.object(http_client, "HTTP_BACKOFF_BASE", 0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        http_client.get_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_5xx_is_retried_up_to_max_retries(self):
+        response = http_client.post(f"{self.base_url}/unavailable", json={})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.hits), 3)
+        stats = http_client.http_stats()
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(stats["requests"], 3)
+
+    def test_read_timeout_is_not_retried(self):
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            http_client.post(f"{self.base_url}/slow", json={}, timeout=(1, 0.2))
+
+        self.assertEqual(len(self.server.hits), 1)
+        stats = http_client.http_stats()
+        self.assertEqual(stats["retries"], 0)
+        self.assertEqual(stats["errors"], 1)
+
+    def test_connection_is_reused(self):
+        session = http_client.get_session()
+        for _ in range(3):
+            self.assertEqual(http_client.post(f"{self.base_url}/ok", json={}).status_code, 200)
+
+        self.assertIs(http_client.get_session(), session)
+        self.assertEqual(len({client for _, client in self.server.hits}), 1)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import post_student_data , merge_videos, post_job_data, DeleteStudentData,CheckBatchId
+from .views import post_student_data , merge_videos, merge_status, spool_status, chunk_upload_urls, post_job_data, DeleteStudentData,CheckBatchId
 from .libcode import TokenObtainPairView,TokenRefreshView
 from django.conf.urls.static import static
 from django.conf import settings
@@ -9,6 +9,9 @@ urlpatterns = [
     path('api/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/access_token',TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path("api/merge_videos/", merge_videos.as_view(), name="merge_videos"),
+    path("api/merge_status/<str:session_id>/", merge_status.as_view(), name="merge_status"),
+    path("api/chunk_upload_urls/", chunk_upload_urls.as_view(), name="chunk_upload_urls"),
+    path("api/spool_status/", spool_status.as_view(), name="spool_status"),
     path('api/get-student-data/', GetStudentData.as_view(), name='get_student_data'),
     path("api/post-job-details/", post_job_data.as_view(), name = "post_job_data"),
     path("api/post-student-details/", post_student_data.as_view(), name = "post_student_job_data"),
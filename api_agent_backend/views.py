@@ -1,20 +1,23 @@
-from pathlib import Path
 import json
 from rest_framework.response import Response
 from rest_framework.views import APIView
-import time
-from concurrent.futures import ThreadPoolExecutor
 from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
 
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
 from django.http import JsonResponse
 from .serializers import JobDataSerializer , StudentDataSerializer
-from api_agent_backend.merg_chunks import merge_chunks
-from api_agent_backend.Upload_S3 import upload_video_to_s3, store_video_urls_in_db
+from api_agent_backend.merg_chunks import MERGE_MODES
+from api_agent_backend.encoder_profiles import ENCODER_PROFILES
+from api_agent_backend.task import enqueue_merge
+from api_agent_backend.merge_status import get_merge_status
+from api_agent_backend.merge_pipeline import BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
+from api_agent_backend.Upload_S3 import presigned_chunk_upload_urls
+from api_agent_backend.spool import published_spool_usage
 
-from .models import StudentJobData
+from .models import StudentJobData, LipsyncSession
 
 from decouple import config
 
@@ -23,87 +26,8 @@ from django.conf import settings
 
 CUSTOM_BASE_URL = config('CUSTOM_BASE_URL')
 
-BASE_DIR = Path(config('BASE_DIR'))
-
-BUCKET_NAME = config('BUCKET_NAME')
-AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
-AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
-
-executor = ThreadPoolExecutor(max_workers=10)
-
-def wait_for_folder(path, retries=5, delay=2):
-    for i in range(retries):
-        if path.exists():
-            print(f"Folder found: {path}")
-            return True
-        print(f"Waiting for folder: {path} (Attempt {i+1}/{retries})")
-        time.sleep(delay)
-    return False
-
-def process_merge_and_upload(session_id):
-    try:
-        print("\nInside process_merge_and_upload function")
-        print(f"Session ID: {session_id}")
- 
-        session_id_screen = session_id + "_screen"
- 
-        paths = {
-            "screen": {
-                "input": BASE_DIR / "screen_uploads" / session_id_screen,
-                "folder_type": "screen_uploads"
-            },
-            "camera": {
-                "input": BASE_DIR / "uploads" / session_id,
-                "folder_type": "Camera_uploads"
-            }
-        }
- 
-        screen_url = None
-        camera_url = None
- 
-        for key, val in paths.items():
-            input_path = val["input"]
-            folder_type = val["folder_type"]
- 
-            output_file = input_path / f"final_{session_id}.mp4"
- 
-            print(f"Checking for folder: {input_path}")
- 
-            if wait_for_folder(input_path, retries=5, delay=2):
-                success, msg = merge_chunks(input_path, output_file)
-                print(f"Merging {folder_type}: Success={success}, Message='{msg}'")
- 
-                if success:
-                    s3_video_file_url = upload_video_to_s3(
-                        file_name=str(output_file),
-                        bucket_name=BUCKET_NAME,
-                        session_id=session_id,
-                        folder_type=folder_type,
-                        aws_access_key_id=AWS_ACCESS_KEY_ID,
-                        aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-                    )
-                    if s3_video_file_url:
-                        print(f"Video uploaded to S3 ({folder_type}): {s3_video_file_url}")
- 
-                        if folder_type == "screen_uploads":
-                            screen_url = s3_video_file_url
-                        elif folder_type == "Camera_uploads":
-                            camera_url = s3_video_file_url
-                else:
-                    print(f"Merging failed for {folder_type}. Skipping upload.")
-            else:
-                print(f"Folder not found after retries: {input_path}. Skipping {folder_type}.")
- 
-        if screen_url or camera_url:
-            print(f"Storing URLs in database: screen_url={screen_url}, camera_url={camera_url}")
-            store_video_urls_in_db(session_id, screen_url=screen_url, camera_url=camera_url)
-        else:
-            print(f"No videos to store for session_id: {session_id}")
- 
-    except Exception as e:
-        print(f"Exception in process_merge_and_upload for session_id={session_id}: {str(e)}")
-
-
+CHUNK_FOLDER_TYPES = {"camera": "Camera_uploads", "screen": "screen_uploads"}
+MAX_PRESIGNED_CHUNKS = 500
 
 
 
@@ -158,8 +82,21 @@ class merge_videos(APIView):
     
                 if not session_id:
                     return JsonResponse({"error": "Missing session_id"}, status=400)
+
+                merge_mode = data.get("merge_mode")
+                if merge_mode and merge_mode not in MERGE_MODES:
+                    return JsonResponse({"error": f"Invalid merge_mode, expected one of {', '.join(MERGE_MODES)}"}, status=400)
     
-                executor.submit(process_merge_and_upload, session_id)
+                hls = data.get("hls")
+                if hls is not None and not isinstance(hls, bool):
+                    return JsonResponse({"error": "hls must be true or false"}, status=400)
+
+                profile = data.get("profile")
+                if profile and profile not in ENCODER_PROFILES:
+                    return JsonResponse({"error": f"Invalid profile, expected one of {', '.join(ENCODER_PROFILES)}"}, status=400)
+    
+                if not enqueue_merge(session_id, merge_mode, hls, profile):
+                    return JsonResponse({"success": True, "message": f"Merge already queued or running for {session_id}"}, status=200)
                 return JsonResponse({"success": True, "message": f"Merging started for {session_id}"}, status=200)
             
             except json.JSONDecodeError:
@@ -168,6 +105,69 @@ class merge_videos(APIView):
                 return JsonResponse({"error": str(e)}, status=500)
     
         return JsonResponse({"error": "Invalid request method"}, status=405)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class chunk_upload_urls(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Return presigned S3 uploads for a session's recording chunks.
+        Expects session_id, stream ("camera" or "screen") and chunk_indexes.
+        Only sessions that are still recording get uploads.
+        """
+        session_id = request.data.get("session_id")
+        stream = request.data.get("stream")
+        indexes = request.data.get("chunk_indexes")
+
+        if not session_id:
+            return JsonResponse({"error": "Missing session_id"}, status=400)
+        if stream not in CHUNK_FOLDER_TYPES:
+            return JsonResponse({"error": "stream must be 'camera' or 'screen'"}, status=400)
+        if (not isinstance(indexes, list) or not indexes or len(indexes) > MAX_PRESIGNED_CHUNKS
+                or not all(isinstance(i, int) and i >= 0 for i in indexes)):
+            return JsonResponse({"error": f"chunk_indexes must be a list of up to {MAX_PRESIGNED_CHUNKS} non-negative integers"}, status=400)
+
+        session = LipsyncSession.objects.filter(openai_session_id=session_id).first()
+        if not session:
+            return JsonResponse({"error": f"Unknown session {session_id}"}, status=404)
+        if session.ended_at is not None or session.Status.lower() == 'session expired':
+            return JsonResponse({"error": f"Session {session_id} is no longer recording"}, status=403)
+
+        try:
+            urls = presigned_chunk_upload_urls(
+                BUCKET_NAME, session_id, CHUNK_FOLDER_TYPES[stream], indexes,
+                aws_access_key_id=AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+            )
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+        return JsonResponse({"success": True, "session_id": session_id, "stream": stream, "urls": urls}, status=200)
+
+
+class spool_status(APIView):
+    def get(self, request, *args, **kwargs):
+        """Return the spool usage last reported by each merge worker host."""
+        try:
+            return JsonResponse({"nodes": published_spool_usage()}, status=200)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+
+class merge_status(APIView):
+    def get(self, request, session_id, *args, **kwargs):
+        """Return merge progress for a session, per stream (screen/camera) and overall."""
+        try:
+            streams = get_merge_status(session_id)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+        if not streams:
+            return JsonResponse({"error": f"No merge status for {session_id}"}, status=404)
+
+        return JsonResponse({"session_id": session_id, "status": streams}, status=200)
     
     
 
@@ -12,6 +12,14 @@ app.conf.beat_schedule = {
         "task": "api_agent_backend.task.check_pending_evaluations",
         "schedule": timedelta(seconds=300),
     },
+    "abort_stale_uploads": {
+        "task": "api_agent_backend.task.abort_stale_uploads",
+        "schedule": timedelta(hours=1),
+    },
+    "enforce_spool_budget": {
+        "task": "api_agent_backend.task.enforce_spool_budget",
+        "schedule": timedelta(minutes=10),
+    },
 }
 
 app.autodiscover_tasks()
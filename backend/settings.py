@@ -45,6 +45,16 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/London'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# Session merges run on their own queue so they scale with merge workers, not
+# web processes. One message at a time per worker process, and a visibility
+# timeout an hour longer than MERGE_LOCK_TTL (the longest a merge is expected
+# to take) so a long merge is not redelivered while it is still running.
+MERGE_LOCK_TTL = config('MERGE_LOCK_TTL', default=4 * 60 * 60, cast=int)
+CELERY_TASK_ROUTES = {
+    'api_agent_backend.task.merge_session': {'queue': 'merge'},
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': MERGE_LOCK_TTL + 60 * 60}
 
 
 ROOT_URLCONF = "backend.urls"
@@ -78,6 +88,15 @@ DATABASES = {
     }
 }
 
+# Evaluation requests a dispatcher worker keeps waiting for a response at once.
+EVALUATION_MAX_IN_FLIGHT = config('EVALUATION_MAX_IN_FLIGHT', default=4, cast=int)
+
+# Raw-SQL connection pool per process (api_agent_backend.db_pool).
+# check_pending_evaluations holds one connection for claiming sessions and one
+# per in-flight send, so the default adds a spare to that. mysql-connector
+# refuses pools over 32 connections.
+DB_POOL_SIZE = min(config('DB_POOL_SIZE', default=EVALUATION_MAX_IN_FLIGHT + 2, cast=int), 32)
+
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (